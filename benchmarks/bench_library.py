@@ -0,0 +1,215 @@
+"""times each phase of both scripts on synthetic libraries of several sizes
+
+usage: python benchmarks/bench_library.py [--sizes 100,1000,10000]
+                                          [--root DIR] [--output PATH]
+
+every size runs in a fresh process, against a library built by library.py
+under --root (a tmpfs such as /dev/shm by default, so the disk isn't what's
+measured). a size is the number of movies and of tv shows. the results are
+written as JSON, by default to benchmarks/results/library-<commit>.json, so
+runs on different commits can be compared
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+
+from common import ROOT, configure
+from library import generate
+
+RESULTS = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+class Phases:
+    """seconds spent in each phase, added up over every call"""
+
+    def __init__(self):
+        self.seconds = dict()
+
+    def run(self, phase: str, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.seconds[phase] = (self.seconds.get(phase, 0.0)
+                               + time.perf_counter() - start)
+        return result
+
+
+def bench_movies(phases: Phases) -> dict:
+    from mediamanager import MovieMover, Config
+
+    mover = MovieMover(Config().library('movies'))
+
+    all_files = phases.run('walk', mover.list_files_on_source)
+    phases.run('rescan', mover.list_files_on_source)
+
+    videos, subtitles = phases.run('search', MovieMover.search, all_files)
+    changes = phases.run('names', MovieMover.process_new_titles,
+                         videos, subtitles)
+    manifest = phases.run('manifest', mover.process_manifest,
+                          sorted(changes, key=lambda n: n[1]))
+
+    mover.set_file_operation()
+    staged = phases.run('stage', mover.run_threads, manifest)
+    promoted = phases.run('promote', mover.move_files_to_target, staged)
+    mover.clear_stage()
+
+    return {'files': len(all_files), 'videos': len(videos),
+            'moved': len(promoted)}
+
+
+def bench_tv(phases: Phases) -> dict:
+    from mediamanager import TvMover, Config
+
+    mover = TvMover(Config().library('tv'))
+
+    def walk():
+        return sum(len(files)
+                   for _, _, files in mover.index.walk(mover.src_path))
+
+    files = phases.run('walk', walk)
+    phases.run('rescan', walk)
+
+    planned = list()
+    for tv_show in mover.list_tv_shows_on_source():
+        episodes, specials = phases.run('plan', mover.clean_tv_show,
+                                        tv_show)
+        planned.append((tv_show, episodes, specials))
+
+    staged = list()
+    for tv_show, episodes, specials in planned:
+        staged += phases.run('stage', mover.run_threads, episodes)
+        if len(specials) > 0:
+            mover.create_specials_folder(tv_show)
+            phases.run('stage', mover.move_specials, specials)
+            staged += [new_path for _, new_path, _ in specials]
+
+    promoted = phases.run('promote', mover.move_files_to_target, staged)
+
+    return {'files': files, 'shows': len(planned),
+            'episodes': sum(len(episodes) for _, episodes, _ in planned),
+            'moved': len(promoted)}
+
+
+def run_size(size: int, workdir: str, args) -> dict:
+    """runs in the child process for one size"""
+    configure(workdir, {'same_device_operation': args.operation})
+
+    start = time.perf_counter()
+    created = generate(workdir, size, size, int(args.video_mb * 1024 ** 2),
+                       args.seed)
+    generated = time.perf_counter() - start
+
+    from mediamanager import Output
+    Output.log.set_level('warning')
+
+    movie_phases, tv_phases = Phases(), Phases()
+    movies = bench_movies(movie_phases)
+    tv = bench_tv(tv_phases)
+    Output.log.flush()
+
+    return {'size': size, 'files': created,
+            'generate_seconds': round(generated, 4),
+            'movies': {**movies, 'seconds': rounded(movie_phases)},
+            'tv': {**tv, 'seconds': rounded(tv_phases)}}
+
+
+def rounded(phases: Phases) -> dict:
+    seconds = {phase: round(s, 4) for phase, s in phases.seconds.items()}
+    seconds['total'] = round(sum(phases.seconds.values()), 4)
+    return seconds
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def default_root() -> str:
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def print_size(result: dict):
+    print(f'{result["size"]:>7,} titles, {result["files"]:,} files '
+          f'(generated in {result["generate_seconds"]:.2f}s)')
+    for library in ('movies', 'tv'):
+        phases = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds
+                           in result[library]['seconds'].items())
+        print(f'{library:>14}: {phases}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100,1000',
+                        help='comma separated numbers of movies and shows')
+    parser.add_argument('--root', default=default_root(),
+                        help='where libraries are built (default: '
+                             '/dev/shm if it exists)')
+    parser.add_argument('--output', help='where the JSON results go')
+    parser.add_argument('--operation', default='link',
+                        choices=['link', 'rename', 'copy'],
+                        help='same_device_operation for both libraries. '
+                             'copy fills in the sparse files, so needs '
+                             'real space')
+    parser.add_argument('--video-mb', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true',
+                        help="don't delete the libraries afterwards")
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size is not None:
+        with open(args.result, 'w') as result_file:
+            json.dump(run_size(args.run_size, args.workdir, args),
+                      result_file)
+        sys.exit(0)
+
+    results = {'commit': commit(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'created': time.time(),
+               'operation': args.operation, 'video_mb': args.video_mb,
+               'sizes': list()}
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        workdir = tempfile.mkdtemp(prefix=f'mediamanager-bench-{size}-',
+                                   dir=args.root)
+        result_path = os.path.join(workdir, 'result.json')
+
+        # the scripts log to stdout, so the child's output is dropped
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--run-size', str(size), '--workdir', workdir,
+             '--result', result_path, '--operation', args.operation,
+             '--video-mb', str(args.video_mb), '--seed', str(args.seed)],
+            stdout=subprocess.DEVNULL)
+
+        if child.returncode != 0:
+            print(f'size {size} failed (exit code {child.returncode}), '
+                  f'library left in {workdir}')
+            sys.exit(child.returncode)
+
+        with open(result_path) as result_file:
+            result = json.load(result_file)
+        results['sizes'].append(result)
+        print_size(result)
+
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        RESULTS, f'library-{results["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    print(f'results written to {output}')
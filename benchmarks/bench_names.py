@@ -0,0 +1,170 @@
+"""measures NameCleaner in names/second, and regenerates the golden
+corpus that tests/test_names.py checks it against
+
+usage: python benchmarks/bench_names.py [--count N] [--regenerate]
+"""
+
+import os
+import re
+import json
+import random
+import argparse
+
+from common import ROOT, configure, timed
+
+GOLDEN_FILE = os.path.join(ROOT, 'tests', 'names.golden.jsonl')
+
+TITLE_WORDS = ['the', 'matrix', 'heat', 'alien', 'star', 'wars', 'return',
+               'of', 'king', 'blade', 'runner', '2049', 'dune', 'part',
+               'two', 'amélie', "ocean's", 'eleven', 'crouching', 'tiger',
+               'hidden', 'dragon', 'mission', 'impossible', 'apollo', '13',
+               'se7en', 'm*a*s*h', 'léon', 'wall-e', 'up', 'her', 'it', 'us']
+
+TAGS = ['1080p', '720p', '2160p', '4k', 'bluray', 'web-dl', 'webrip',
+        'dvdrip', 'x264', 'x265', 'hevc', 'hdr', 'remux', '5.1', 'dts',
+        'aac', 'proper', 'extended', "director's cut", 'uncut', 'repack']
+
+GROUPS = ['yts', 'rarbg', 'sparks', 'fgt', 'ntb', 'evo', 'd3g']
+
+SEPARATORS = ['.', ' ', '_', '-', ', ']
+
+
+def random_title(rng: random.Random) -> str:
+    words = rng.sample(TITLE_WORDS, rng.randint(1, 5))
+    if rng.random() < 0.3:
+        words = [word.capitalize() for word in words]
+    if rng.random() < 0.1:
+        words.insert(rng.randint(0, len(words)), ':')
+    return rng.choice(SEPARATORS).join(words)
+
+
+def random_movie(rng: random.Random) -> str:
+    sep = rng.choice(SEPARATORS)
+    year = str(rng.randint(1920, 2029))
+    title = random_title(rng)
+
+    if rng.random() < 0.4:
+        year = f'({year})' if rng.random() < 0.7 else f'[{year}]'
+
+    parts = [title, year] + rng.sample(TAGS, rng.randint(0, 4))
+    name = sep.join(parts)
+
+    if rng.random() < 0.5:
+        name += '-' + rng.choice(GROUPS).upper()
+    if rng.random() < 0.05:
+        # no year at all
+        name = sep.join([title] + rng.sample(TAGS, 2))
+
+    return name
+
+
+def random_show(rng: random.Random) -> str:
+    sep = rng.choice(SEPARATORS)
+    parts = [random_title(rng)]
+
+    if rng.random() < 0.6:
+        parts.append(f'S{rng.randint(1, 30):02d}')
+    if rng.random() < 0.5:
+        parts += rng.sample(TAGS, rng.randint(1, 3))
+
+    return sep.join(parts)
+
+
+def corpus(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    movies = [random_movie(rng) for _ in range(count)]
+    shows = [random_show(rng) for _ in range(count // 2)]
+    return movies, shows
+
+
+class ReferenceNameCleaner:
+    """NameCleaner as it was before names were cleaned in a single pass,
+    kept to produce the golden file and the "before" timings"""
+
+    @staticmethod
+    def movie_name(current_name: str):
+        years = list(re.finditer(r'(19|20)[0-9]{2}', current_name))
+        if len(years) == 0:
+            return None
+        year = years[-1]
+
+        probably_the_name = current_name[:year.start()]
+        probably_the_name = re.sub(r'[.()_:꞉, ]', '_', probably_the_name)
+        probably_the_name = re.sub(r'[\[\]\']', '', probably_the_name)
+
+        clean_name = f'{probably_the_name}_({year.group(0)})'
+
+        while '__' in clean_name:
+            clean_name = clean_name.replace('__', '_')
+
+        if len(clean_name.strip()) > 7:
+            return clean_name
+
+        return None
+
+    @staticmethod
+    def tv_show_name(current_name: str):
+        season = re.search(r'([sS]\d+)', current_name)
+
+        probably_the_name = (current_name[:season.start()]
+                             if season else current_name)
+
+        probably_the_name = re.sub(r'[.()_:꞉, ]', '_', probably_the_name)
+        probably_the_name = re.sub(r'[\[\]\']', '', probably_the_name)
+
+        while '__' in probably_the_name:
+            probably_the_name = probably_the_name.replace('__', '_')
+
+        return probably_the_name
+
+
+def regenerate(count: int):
+    movies, shows = corpus(count)
+
+    with open(GOLDEN_FILE, 'w', encoding='utf-8') as golden:
+        for name in movies:
+            record = {'kind': 'movie', 'name': name,
+                      'clean': ReferenceNameCleaner.movie_name(name)}
+            golden.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        for name in shows:
+            record = {'kind': 'tv', 'name': name,
+                      'clean': ReferenceNameCleaner.tv_show_name(name)}
+            golden.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def benchmark(NameCleaner, count: int):
+    movies, shows = corpus(count, seed=1)
+
+    cases = [('movie', movies, ReferenceNameCleaner.movie_name,
+              NameCleaner.movie_name),
+             ('tv', shows, ReferenceNameCleaner.tv_show_name,
+              NameCleaner.tv_show_name)]
+
+    for kind, names, before, after in cases:
+        before_time, _ = timed(lambda: [before(n) for n in names])
+        after_time, _ = timed(lambda: [after(n) for n in names])
+        many_time, _ = timed(NameCleaner.clean_many, names, kind)
+
+        for label, seconds in (('before', before_time),
+                               ('after', after_time),
+                               ('clean_many', many_time)):
+            print(f'{kind:>5} {label:>10}: '
+                  f'{len(names) / seconds:>12,.0f} names/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100_000,
+                        help='movie names to time (half as many shows)')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='rewrite the golden file from the reference')
+    args = parser.parse_args()
+
+    if args.regenerate:
+        regenerate(2000)
+
+    configure()
+    from mediamanager.subcomponents import NameCleaner
+
+    benchmark(NameCleaner, args.count)
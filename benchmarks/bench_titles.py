@@ -0,0 +1,51 @@
+"""measures building the title index and looking up near-matches in it
+
+usage: python benchmarks/bench_titles.py [--library N] [--lookups N]
+"""
+
+import random
+import argparse
+
+from common import configure, timed
+from bench_names import random_title
+
+
+def library(rng: random.Random, count: int) -> list:
+    files = list()
+    for _ in range(count):
+        title = random_title(rng).lower()
+        name = ''.join(c if c.isalnum() else '_' for c in title)
+        files.append(('/library', f'{name}_({rng.randint(1920, 2029)}).mkv'))
+    return files
+
+
+def variant(rng: random.Random, file_name: str) -> str:
+    # what a new copy of a movie tends to look like
+    stem, extension = file_name.rsplit('.', 1)
+    if rng.random() < 0.5:
+        stem = f'the_{stem}'
+    return f'{stem}.{extension}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--library', type=int, default=20_000,
+                        help='movies in the target library')
+    parser.add_argument('--lookups', type=int, default=10_000)
+    args = parser.parse_args()
+
+    configure()
+    from mediamanager.titles import TitleIndex
+
+    rng = random.Random(0)
+    files = library(rng, args.library)
+    queries = [variant(rng, rng.choice(files)[1])
+               for _ in range(args.lookups)]
+
+    build_time, index = timed(TitleIndex.from_files, files)
+    lookup_time, matches = timed(lambda: [index.match(q) for q in queries])
+
+    found = sum(1 for match in matches if match is not None)
+    print(f'build: {build_time:.3f}s for {len(index):,} titles')
+    print(f'lookup: {lookup_time / len(queries) * 1e6:.1f}us per title '
+          f'({found:,}/{len(queries):,} matched)')
@@ -0,0 +1,97 @@
+"""compares os.walk with the parallel scandir walker and the scan index
+
+usage: python benchmarks/bench_walk.py [--shows N] [--latency MS]
+
+--latency adds a delay to every directory listing, to mimic the round
+trip of listing a directory on an SMB/NFS share
+"""
+
+import os
+import time
+import argparse
+
+from common import configure, timed
+
+
+def build_tree(root: str, shows: int, seasons: int, episodes: int):
+    for show in range(shows):
+        for season in range(1, seasons + 1):
+            folder = f'{root}/Show.{show:05d}/Season {season}'
+            os.makedirs(folder, exist_ok=True)
+            for episode in range(1, episodes + 1):
+                name = f'Show.{show:05d}.S{season:02d}E{episode:02d}.mkv'
+                open(f'{folder}/{name}', 'wb').close()
+
+
+def with_latency(latency: float):
+    from mediamanager import walker
+
+    scandir = os.scandir
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(latency)
+        return scandir(*args, **kwargs)
+
+    os.scandir = slow_scandir
+
+    # the tree is local, so it would be walked serially otherwise
+    walker.is_remote = lambda path: True
+
+
+def os_walk(top: str) -> list:
+    # the scan as it was before the parallel walker
+    all_files = list()
+    for root, _, files in os.walk(top):
+        for file in files:
+            all_files.append((root, file))
+    return all_files
+
+
+def parallel_walk(top: str) -> list:
+    from mediamanager.walker import ParallelWalker
+
+    all_files = list()
+    for root, _, files in ParallelWalker().walk(top):
+        for file, *_ in files:
+            all_files.append((root, file))
+    return all_files
+
+
+def index_walk(index, top: str) -> list:
+    all_files = list()
+    for root, _, files in index.walk(top):
+        for file, *_ in files:
+            all_files.append((root, file))
+    return all_files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shows', type=int, default=500)
+    parser.add_argument('--seasons', type=int, default=4)
+    parser.add_argument('--episodes', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='milliseconds added to each directory listing')
+    args = parser.parse_args()
+
+    workdir = configure()
+    top = f'{workdir}/tv/src'
+    build_tree(top, args.shows, args.seasons, args.episodes)
+
+    if args.latency > 0:
+        with_latency(args.latency / 1000)
+
+    from mediamanager.index import ScanIndex
+
+    index = ScanIndex(f'{workdir}/bench.db')
+
+    results = [('os.walk', *timed(os_walk, top)),
+               ('parallel walker', *timed(parallel_walk, top)),
+               ('index (cold)', *timed(index_walk, index, top, repeat=1)),
+               ('index (warm)', *timed(index_walk, index, top))]
+
+    expected = sorted(results[0][2])
+    for label, seconds, files in results:
+        status = 'ok' if sorted(files) == expected else 'MISMATCH'
+        print(f'{label:>16}: {seconds:8.3f}s '
+              f'({len(files):,} files, {status})')
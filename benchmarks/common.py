@@ -0,0 +1,54 @@
+"""helpers shared by the benchmark scripts"""
+
+import os
+import sys
+import time
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(workdir: str = None, settings: dict = None) -> str:
+    """creates a media.cfg with throwaway libraries in workdir and moves
+    into it, so mediamanager can be imported without touching real files.
+    settings are added to both libraries"""
+    workdir = workdir or tempfile.mkdtemp(prefix='mediamanager-bench-')
+    workdir = workdir.replace('\\', '/')
+
+    sections = list()
+    for library in ('tv', 'movies'):
+        paths = dict()
+        for kind in ('src', 'stg', 'tgt'):
+            paths[kind] = f'{workdir}/{library}/{kind}'
+            os.makedirs(paths[kind], exist_ok=True)
+
+        sections.append(f'[{library}]\n'
+                        f'src_path={paths["src"]}\n'
+                        f'stg_path={paths["stg"]}\n'
+                        f'tgt_path={paths["tgt"]}\n'
+                        + ''.join(f'{key}={value}\n'
+                                  for key, value in (settings or {}).items()))
+
+    with open(f'{workdir}/media.cfg', 'w') as cfg_file:
+        cfg_file.write('\n'.join(sections))
+
+    os.chdir(workdir)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    return workdir
+
+
+def timed(fn, *args, repeat: int = 3):
+    """returns (best seconds, result) over repeat calls of fn(*args)"""
+    best = None
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
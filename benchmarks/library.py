@@ -0,0 +1,155 @@
+"""generates synthetic media libraries of sparse files
+
+movies get release-style folder and file names, some with subtitles,
+samples and junk files next to them. shows get a folder named the way
+clean_tv expects (eg. The_Show), messy season folders ("Season 1", "S01",
+"season_01", "Specials"), a mix of episode naming styles, subtitles and
+extras
+
+every video is a sparse file, so a library of thousands of titles takes
+almost no space, and can be built on a tmpfs such as /dev/shm
+
+usage: python benchmarks/library.py ROOT [--shows N] [--movies N]
+"""
+
+import os
+import random
+import argparse
+
+from bench_names import TITLE_WORDS, TAGS, GROUPS, random_movie
+
+SHOW_WORDS = [word.capitalize() for word in TITLE_WORDS if word.isalnum()]
+
+SEASON_FOLDERS = ['Season {n}', 'Season {n:02d}', 'S{n:02d}',
+                  'season_{n:02d}', 's{n}']
+
+EPISODE_STYLES = ['{show}.S{season:02d}E{episode:02d}.{tags}',
+                  '{show} - S{season:02d}E{episode:02d} - Episode {episode}',
+                  '{show} {season}x{episode:02d}',
+                  '{show}_s{season:02d}e{episode:02d}_{tags}',
+                  '{show}.S{season:02d}E{episode:02d}E{next:02d}.{tags}']
+
+EXTRAS = ['behind the scenes', 'deleted scenes', 'bloopers', 'interview',
+          'making of']
+
+
+def sparse_file(path: str, size: int, rng: random.Random):
+    # a few random bytes up front, or every video of a size would have the
+    # same fingerprint and all but one would be skipped as duplicates
+    with open(path, 'wb') as file:
+        file.write(rng.randbytes(min(size, 64)))
+        file.truncate(size)
+
+
+def show_folder(rng: random.Random) -> str:
+    return '_'.join(rng.sample(SHOW_WORDS, rng.randint(1, 4)))
+
+
+def unique(make, seen: set, rng: random.Random) -> str:
+    while True:
+        name = make(rng)
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            return name
+
+
+def generate_movies(root: str, count: int, rng: random.Random,
+                    video_size: int) -> int:
+    """returns the number of files created"""
+    files = 0
+    seen = set()
+
+    for _ in range(count):
+        folder = f'{root}/{unique(random_movie, seen, rng)}'
+        os.makedirs(folder, exist_ok=True)
+
+        # search lowercases the names it finds, so movie files are
+        # lowercase, as release files usually are
+        name = folder.rsplit('/', 1)[-1].lower()
+
+        extension = rng.choice(['mkv', 'mkv', 'mp4', 'avi'])
+        sparse_file(f'{folder}/{name}.{extension}', video_size, rng)
+        files += 1
+
+        if rng.random() < 0.4:
+            for language in rng.sample(['', '.en', '.fr', '.spa'],
+                                       rng.randint(1, 2)):
+                sparse_file(f'{folder}/{name}{language}.srt', 40_000, rng)
+                files += 1
+
+        if rng.random() < 0.2:
+            sparse_file(f'{folder}/sample.{extension}', video_size // 20, rng)
+            files += 1
+
+        if rng.random() < 0.3:
+            sparse_file(f'{folder}/{name}.nfo', 2_000, rng)
+            files += 1
+
+    return files
+
+
+def generate_shows(root: str, count: int, rng: random.Random,
+                   video_size: int) -> int:
+    """returns the number of files created"""
+    files = 0
+    seen = set()
+
+    for _ in range(count):
+        folder_name = unique(show_folder, seen, rng)
+        show = folder_name.replace('_', rng.choice(['.', ' ', '_']))
+        season_folder = rng.choice(SEASON_FOLDERS)
+        style = rng.choice(EPISODE_STYLES)
+
+        for season in range(1, rng.randint(1, 4) + 1):
+            folder = f'{root}/{folder_name}/{season_folder.format(n=season)}'
+            os.makedirs(folder, exist_ok=True)
+
+            for episode in range(1, rng.randint(6, 24) + 1):
+                tags = '.'.join(rng.sample(TAGS, 2)) + '-' + rng.choice(
+                    GROUPS).upper()
+                name = style.format(show=show, season=season,
+                                    episode=episode, next=episode + 1,
+                                    tags=tags)
+
+                sparse_file(f'{folder}/{name}.mkv', video_size, rng)
+                files += 1
+
+                if rng.random() < 0.3:
+                    sparse_file(f'{folder}/{name}.en.srt', 40_000, rng)
+                    files += 1
+
+            if rng.random() < 0.1:
+                sparse_file(f'{folder}/sample.mkv', video_size // 20, rng)
+                files += 1
+
+        if rng.random() < 0.3:
+            folder = f'{root}/{folder_name}/Specials'
+            os.makedirs(folder, exist_ok=True)
+            for extra in rng.sample(EXTRAS, rng.randint(1, 3)):
+                sparse_file(f'{folder}/{extra}.mp4', video_size // 4, rng)
+                files += 1
+
+    return files
+
+
+def generate(root: str, shows: int, movies: int, video_size: int,
+             seed: int = 0) -> int:
+    rng = random.Random(seed)
+    files = generate_movies(f'{root}/movies/src', movies, rng, video_size)
+    files += generate_shows(f'{root}/tv/src', shows, rng, video_size)
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('root')
+    parser.add_argument('--shows', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--video-mb', type=float, default=1.0,
+                        help='apparent size of each video (files are sparse)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    created = generate(args.root, args.shows, args.movies,
+                       int(args.video_mb * 1024 ** 2), args.seed)
+    print(f'{created:,} files created in {args.root}')
@@ -1,12 +1,85 @@
 """module for moving movie files for a media server"""
 
-from mediamanager import MovieMover
+import sys
+import argparse
+
+from mediamanager import (MovieMover, Output, Config, ConfigError,
+                          PlanError, Watcher)
 
 
 if __name__ == '__main__':
     """Renames movies to a cleaner format at the given path"""
-    all_files = MovieMover.list_files_on_source()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--library', metavar='NAME',
+                        help='only deploy this library, eg. movies.4k '
+                             '(default: every movies library)')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='rescan every directory instead of '
+                             'trusting the scan index')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--batch', action='store_true',
+                      help='plan every movie before copying any, '
+                           'instead of copying as movies are found')
+    mode.add_argument('--plan', metavar='PATH',
+                      help='write the deployment plan to PATH '
+                           'without moving anything')
+    mode.add_argument('--apply', metavar='PATH',
+                      help='run a plan written with --plan')
+    mode.add_argument('--watch', action='store_true',
+                      help='keep running, deploying new downloads '
+                           'once they finish')
+    parser.add_argument('--log-level', default='info',
+                        choices=Output.log.LEVELS)
+    parser.add_argument('--log-json', metavar='PATH',
+                        help='also write the log as JSON lines to PATH')
+    parser.add_argument('--metrics', metavar='DIR',
+                        help='write per-phase metrics to DIR as a '
+                             'Prometheus textfile and a JSON summary')
+    args = parser.parse_args()
+
+    Output.log.set_level(args.log_level)
+    if args.log_json:
+        Output.log.add_jsonl_sink(args.log_json)
+    if args.metrics:
+        Output.metrics.enable(args.metrics, args.library or 'movies')
+
+    config = Config()
+    try:
+        names = [args.library] if args.library \
+            else config.libraries('movies')
+        movers = [MovieMover(config.library(name)) for name in names]
+    except ConfigError as e:
+        Output.log.message(e, level='error')
+        sys.exit(1)
+
+    if (args.plan or args.apply) and len(movers) > 1:
+        parser.error('there are several movies libraries, '
+                     'pick one with --library')
+
+    for mover in movers:
+        mover.set_rebuild_index(args.rebuild_index)
+
+    if args.plan:
+        movers[0].save_plan(args.plan)
+    elif args.apply:
+        try:
+            movers[0].apply_plan(args.apply)
+        except PlanError as e:
+            Output.log.message(e, level='error')
+            sys.exit(1)
+    elif args.watch:
+        Watcher.run_all([mover.watcher() for mover in movers])
+    else:
+        for mover in movers:
+            if len(movers) > 1:
+                Output.log.message(f'[{mover.name}]')
+
+            if args.batch:
+                all_files = mover.list_files_on_source()
 
-    videos, subtitles = MovieMover.search(all_files)
-    name_changes = MovieMover.process_new_titles(videos, subtitles)
-    MovieMover.move_files(name_changes)
+                videos, subtitles = MovieMover.search(all_files)
+                name_changes = MovieMover.process_new_titles(videos,
+                                                             subtitles)
+                mover.move_files(name_changes)
+            else:
+                mover.stream_files()
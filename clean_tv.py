@@ -1,24 +1,111 @@
 
-from mediamanager import TvMover
+import sys
+import argparse
 
+from mediamanager import (TvMover, Output, Config, ConfigError,
+                          PlanError, Watcher)
 
-def clean_existing_tv_files():
+
+def clean_existing_tv_files(mover: TvMover):
     """retroactively cleans existing files on the target file system"""
     # !!! BE VERY CAREFUL RUNNING THIS FUNCTION !!!
     # As a precaution, back up the files on your target system before running,
     # as this function edits files directly on the target system,
     # without staging the changes first. A failure could result in data-loss.
+    # Use --existing --plan to review the renames first.
 
-    tv_shows = TvMover.list_tv_shows_on_target()
-    for tv_show in tv_shows:
-        TvMover.clean_tv_show(tv_show, TvMover.tgt_path)
+    renames, conflicts = mover.plan_target_cleanup()
+    mover.clean_target(renames, conflicts)
 
 
-def move_tv_files():
+def move_tv_files(mover: TvMover, concurrent=False):
     """move TV shows from the source system to the target system"""
-    tv_shows = TvMover.list_tv_shows_on_source()
-    TvMover.move_tv_shows(tv_shows)
+    tv_shows = mover.list_tv_shows_on_source()
+
+    if concurrent:
+        mover.move_tv_shows_concurrently(tv_shows)
+    else:
+        mover.move_tv_shows(tv_shows)
 
 
 if __name__ == '__main__':
-    move_tv_files()
+    parser = argparse.ArgumentParser(description=move_tv_files.__doc__)
+    parser.add_argument('--library', metavar='NAME',
+                        help='only deploy this library, eg. tv.anime '
+                             '(default: every tv library)')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='rescan every directory instead of '
+                             'trusting the scan index')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrent', action='store_true',
+                      help='plan the next shows while earlier ones '
+                           'transfer, sharing one transfer pool')
+    mode.add_argument('--plan', metavar='PATH',
+                      help='write the deployment plan to PATH '
+                           'without moving anything')
+    mode.add_argument('--apply', metavar='PATH',
+                      help='run a plan written with --plan')
+    mode.add_argument('--watch', action='store_true',
+                      help='keep running, deploying new downloads '
+                           'once they finish')
+    parser.add_argument('--existing', action='store_true',
+                        help='clean up the names of the shows already on '
+                             'the target, in place')
+    parser.add_argument('--log-level', default='info',
+                        choices=Output.log.LEVELS)
+    parser.add_argument('--log-json', metavar='PATH',
+                        help='also write the log as JSON lines to PATH')
+    parser.add_argument('--metrics', metavar='DIR',
+                        help='write per-phase metrics to DIR as a '
+                             'Prometheus textfile and a JSON summary')
+    args = parser.parse_args()
+
+    Output.log.set_level(args.log_level)
+    if args.log_json:
+        Output.log.add_jsonl_sink(args.log_json)
+    if args.metrics:
+        Output.metrics.enable(args.metrics, args.library or 'tv')
+
+    config = Config()
+    try:
+        names = [args.library] if args.library else config.libraries('tv')
+        movers = [TvMover(config.library(name)) for name in names]
+    except ConfigError as e:
+        Output.log.message(e, level='error')
+        sys.exit(1)
+
+    if (args.plan or args.apply) and len(movers) > 1:
+        parser.error('there are several tv libraries, '
+                     'pick one with --library')
+
+    for mover in movers:
+        mover.set_rebuild_index(args.rebuild_index)
+
+    mover = movers[0]
+    if args.existing and args.plan:
+        mover.save_cleanup_plan(args.plan)
+    elif args.existing and args.apply:
+        try:
+            mover.apply_cleanup_plan(args.apply)
+        except PlanError as e:
+            Output.log.message(e, level='error')
+            sys.exit(1)
+    elif args.plan:
+        mover.save_plan(args.plan, mover.list_tv_shows_on_source())
+    elif args.apply:
+        try:
+            mover.apply_plan(args.apply)
+        except PlanError as e:
+            Output.log.message(e, level='error')
+            sys.exit(1)
+    elif args.watch:
+        Watcher.run_all([mover.watcher() for mover in movers])
+    else:
+        for mover in movers:
+            if len(movers) > 1:
+                Output.log.message(f'[{mover.name}]')
+
+            if args.existing:
+                clean_existing_tv_files(mover)
+            else:
+                move_tv_files(mover, args.concurrent)
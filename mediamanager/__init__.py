@@ -1,4 +1,18 @@
-
 from .components import MovieMover, TvMover
+from .subcomponents import Output
+from .config import Config, ConfigError
+from .plans import PlanError
+from .watch import Watcher
+
+__all__ = ['MovieMover', 'TvMover', 'Output', 'Config', 'ConfigError',
+           'PlanError', 'Watcher', 'Progress']
+
+
+def __getattr__(name):
+    # the asyncio API is imported on first use, since asyncio is slow to
+    # import and the scripts don't need it
+    if name == 'Progress':
+        from .aio import Progress
+        return Progress
 
-__all__ = ['MovieMover', 'TvMover']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
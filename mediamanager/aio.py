@@ -0,0 +1,190 @@
+import asyncio
+import functools
+import threading as thr
+
+from mediamanager.subcomponents import Output
+from mediamanager.journal import TransferCancelled
+from mediamanager.transfer import Promoter
+
+
+class Progress:
+    """An async iterator of the progress events of one or more imports
+
+    each event is a dict with the library, the kind of event, the path
+    and the size of the file in bytes. the kinds are:
+        planned: the file will be transferred (path on the stage)
+        staged: the file was copied to the stage
+        skipped: the file is already on the target
+        promoted: the file was moved to the target (path on the target)
+        failed: the file couldn't be staged or promoted
+        cancelled: the import was cancelled before the file was staged
+
+    iteration ends once every import the progress was given to is done,
+    so it can be started before or after the imports themselves
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self._imports = 0
+
+    def open(self):
+        self._imports += 1
+
+    def close(self):
+        self._imports -= 1
+        if self._imports == 0:
+            self._queue.put_nowait(None)
+
+    def emit(self, library: str, kind: str, path: str, size: int = 0):
+        self._queue.put_nowait({'library': library, 'kind': kind,
+                                'path': path, 'size': size})
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class AsyncDeployment:
+    """One import of a library driven by an asyncio event loop
+
+    blocking work runs on the library's transfer pool, which is shared
+    with every other import, so many imports can run on one loop without
+    a pool each. files are promoted one at a time as they finish staging,
+    like the Promoter does
+
+    use as an async context manager; leaving it waits for every staged
+    file to be promoted. when the task is cancelled, the files being
+    copied are stopped and removed, leaving the transfers of other imports
+    alone. files that were already staged are still promoted
+    """
+
+    def __init__(self, mover, checksums, progress: Progress = None):
+        self.library = mover.name
+        self.scheduler = mover.scheduler
+        self.journal = mover.journal
+        self.fs = mover.fs
+        self.promoter = Promoter(mover.stg_path, mover.tgt_path,
+                                 mover.journal, checksums, fs=mover.fs)
+        self.progress = progress
+
+        # stops the transfers of this import alone
+        self.cancelled = thr.Event()
+
+        self._promotions = None
+        self._promoting = None
+
+    async def __aenter__(self):
+        if self.progress is not None:
+            self.progress.open()
+
+        # a service runs for a long time, and other programs change the
+        # filesystem between imports, so each one starts from a fresh cache
+        self.fs.clear()
+
+        self._promotions = asyncio.Queue()
+        self._promoting = asyncio.ensure_future(self._promote_all())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.drain()
+        self._promoting.cancel()
+
+        if self.progress is not None:
+            self.progress.close()
+
+    def emit(self, kind: str, path: str, size: int = 0):
+        if self.progress is not None:
+            self.progress.emit(self.library, kind, path, size)
+
+    async def call(self, fn, *args):
+        """runs a blocking call on the transfer pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.scheduler.pool,
+                                          functools.partial(fn, *args))
+
+    async def stage(self, fn, jobs: list) -> list:
+        """stages (src, dst[, size]) jobs with fn(src, dst, cancelled),
+        submitting each file for promotion as soon as it's staged.
+        returns the staged paths"""
+        jobs = list(jobs)
+        for _, new_path, *size in jobs:
+            self.emit('planned', new_path, size[0] if size else 0)
+
+        # the planned transfers are journaled in one transaction
+        await self.call(self.journal.plan, jobs)
+
+        results = list()
+        stage = functools.partial(fn, cancelled=self.cancelled)
+
+        # stage path -> size, of the jobs that haven't finished
+        unfinished = {job[1]: job[2] if len(job) > 2 else 0 for job in jobs}
+
+        try:
+            async for (_, new_path, size), future in \
+                    self.scheduler.run_async(stage, jobs,
+                                             cancel=self.cancelled.set):
+                del unfinished[new_path]
+
+                try:
+                    result = future.result()
+                except TransferCancelled:
+                    self.emit('cancelled', new_path, size)
+                    continue
+                except Exception as e:
+                    # the journal has already rolled back the failed file
+                    Output.log.message(e, level='error')
+                    self.emit('failed', new_path, size)
+                    continue
+
+                if result is None:
+                    self.emit('skipped', new_path, size)
+                    continue
+
+                self.emit('staged', result, size)
+                results.append(result)
+                self._promotions.put_nowait((result, size))
+
+        except asyncio.CancelledError:
+            for new_path, size in unfinished.items():
+                if await self.call(self.abandon, new_path):
+                    self.emit('cancelled', new_path, size)
+                else:
+                    self.emit('staged', new_path, size)
+                    self._promotions.put_nowait((new_path, size))
+            raise
+
+        return results
+
+    def abandon(self, stage_path: str) -> bool:
+        """drops the journal row of a cancelled job, removing what was
+        copied of it. returns False if it was staged after all, since
+        with rename the staged file may be the only copy"""
+        row = self.journal.lookup(stage_path)
+        if row is not None and row[3] == 'staged':
+            return False
+
+        self.journal.discard(stage_path)
+        self.fs.remove_file(stage_path)
+        return True
+
+    async def drain(self):
+        """waits until every staged file was promoted"""
+        await self._promotions.join()
+
+    async def _promote_all(self):
+        while True:
+            staged_path, size = await self._promotions.get()
+            try:
+                new_path = await self.call(self.promoter.promote_one,
+                                           staged_path)
+                if new_path is None:
+                    self.emit('failed', staged_path, size)
+                else:
+                    self.emit('promoted', new_path, size)
+            finally:
+                self._promotions.task_done()
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import hashlib
+import threading as thr
+
+from mediamanager.subcomponents import Constants
+from mediamanager.fingerprints import FingerprintIndex
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class StreamDigest:
+    """Hashes a file from the chunks that pass through a copy, giving both
+    a BLAKE2 digest of the whole file and the sampled fingerprint used for
+    duplicate detection, without reading the file again
+
+    chunks must be fed in order, starting from offset 0
+    """
+
+    def __init__(self, size: int,
+                 chunk_size: int = Constants.Duplicates.CHUNK_SIZE):
+        self.size = size
+        self.digest = hashlib.blake2b()
+
+        self._ranges = FingerprintIndex.sample_ranges(size, chunk_size)
+        self._samples = [bytearray() for _ in self._ranges]
+
+    def update(self, offset: int, data):
+        self.digest.update(data)
+
+        end = offset + len(data)
+        for (start, stop), sample in zip(self._ranges, self._samples):
+            if start < end and offset < stop:
+                sample += data[max(start, offset) - offset:
+                               min(stop, end) - offset]
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+    def fingerprint(self) -> str:
+        digest = FingerprintIndex.new_digest(self.size)
+        for sample in self._samples:
+            digest.update(sample)
+        return digest.hexdigest()
+
+    def verify(self, path: str, full: bool = False):
+        """checks a written copy against the stream, either by re-reading
+        its fingerprint samples or, if full, the whole file"""
+        size = os.stat(path).st_size
+        if size != self.size:
+            raise ChecksumError(f'{path}: size {size} != {self.size}')
+
+        if full:
+            written = hashlib.blake2b()
+            with open(path, 'rb') as file:
+                # hashlib.file_digest would do, but needs python 3.11
+                for chunk in iter(lambda: file.read(
+                        Constants.Transfer.BUFFER_SIZE), b''):
+                    written.update(chunk)
+            matches = written.hexdigest() == self.hexdigest()
+        else:
+            written = FingerprintIndex.new_digest(size)
+            with open(path, 'rb') as file:
+                for start, end in self._ranges:
+                    file.seek(start)
+                    written.update(file.read(end - start))
+            matches = written.hexdigest() == self.fingerprint()
+
+        if not matches:
+            raise ChecksumError(f'{path}: checksum mismatch')
+
+
+class ChecksumManifest:
+    """The digests of every file copied during a run
+
+    digests are kept by staged path until the file is promoted, then
+    written as a JSON line with the target path to a manifest named after
+    the start of the run, and handed to the fingerprint index so later
+    runs don't read the file again to find duplicates
+    """
+
+    def __init__(self, directory: str = Constants.Checksums.DIRECTORY,
+                 fingerprints: FingerprintIndex = None):
+        self.directory = directory
+        self.fingerprints = fingerprints
+        self.path = os.path.join(directory,
+                                 time.strftime('%Y%m%d-%H%M%S') + '.jsonl')
+
+        self._file = None
+        self._lock = thr.Lock()
+        self._pending = dict()
+
+    def record(self, src: str, dst: str, digest: StreamDigest):
+        with self._lock:
+            self._pending[dst.replace('\\', '/')] = (src, digest)
+
+    def promoted(self, staged_path: str, target_path: str):
+        with self._lock:
+            pending = self._pending.pop(staged_path, None)
+            if pending is None:
+                return
+
+            src, digest = pending
+
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+
+            record = {'path': target_path, 'source': src,
+                      'size': digest.size, 'blake2b': digest.hexdigest()}
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+        if self.fingerprints is not None:
+            self.fingerprints.remember(target_path, digest.fingerprint())
@@ -1,166 +1,640 @@
 import os
 import re
 import shutil as sh
-import configparser as cfg
+import threading as thr
+import itertools
+import multiprocessing as mp
 import concurrent.futures
 
 from mediamanager.subcomponents import (Output, FileMover,
                                         Constants, NameCleaner)
-
-config = cfg.ConfigParser()
-config.read('media.cfg')
+from mediamanager.index import ScanIndex
+from mediamanager.fscache import MetadataCache
+from mediamanager.fingerprints import FingerprintIndex
+from mediamanager.checksums import ChecksumManifest
+from mediamanager.journal import TransferJournal, TransferCancelled
+from mediamanager.pipeline import Pipeline
+from mediamanager.plans import Plan
+from mediamanager.sidecars import SidecarIndex
+from mediamanager.renames import RenameGraph
+from mediamanager.titles import TitleIndex
+from mediamanager.scheduler import IoScheduler
+from mediamanager.watch import Watcher
+from mediamanager.transfer import (CopyEngine, Promoter, choose_operation,
+                                   operation_by_name, same_device)
+
+# shared by every library in the process
+scan_index = ScanIndex(Constants.INDEX_FILE)
+fs_cache = MetadataCache()
+fingerprints = FingerprintIndex(scan_index)
+checksums = ChecksumManifest(fingerprints=fingerprints)
+transfer_journal = TransferJournal(Constants.JOURNAL_FILE)
+transfer_pool = concurrent.futures.ThreadPoolExecutor(
+    IoScheduler.MAX_WORKERS, thread_name_prefix='transfer')
+
+Output.metrics.count_syscalls(lambda: scan_index.syscalls)
+Output.metrics.count_syscalls(lambda: fs_cache.syscalls)
 
 
 class MovieMover(FileMover):
-    src_path = config['movies']['src_path'].replace('\\', '/')
-    stg_path = config['movies']['stg_path'].replace('\\', '/')
-    tgt_path = config['movies']['tgt_path'].replace('\\', '/')
+    """Deploys one movies library, eg. the [movies] or [movies.4k] section
+    of the config"""
 
-    move = sh.copyfile
+    index = scan_index
+    journal = transfer_journal
+    fingerprints = fingerprints
+    fs = fs_cache
 
-    @staticmethod
-    def list_files_on_source():
-        movies_folder = os.walk(MovieMover.src_path)
+    def __init__(self, section):
+        self.name = section.name
+
+        self.src_path = section['src_path'].replace('\\', '/')
+        self.stg_path = section['stg_path'].replace('\\', '/')
+        self.tgt_path = section['tgt_path'].replace('\\', '/')
+
+        self.copy = CopyEngine.from_config(section, checksums)
+        self.move = self.copy
+
+        self.scheduler = IoScheduler.from_config(section, transfer_pool)
+
+        self.same_device_operation = section.get(
+            'same_device_operation',
+            Constants.Transfer.SAME_DEVICE_OPERATION)
+        self.operation = None
+
+        # skip, link (hardlink the copy already on target) or copy
+        self.duplicate_policy = section.get('duplicates',
+                                            Constants.Duplicates.POLICY)
+        self.duplicates = list()
+
+        # movies probably on target under a similar title:
+        # skip, replace_if_larger or keep_both
+        self.similar_policy = section.get('similar_titles',
+                                          Constants.Titles.POLICY)
+        self.titles = TitleIndex(section.getfloat(
+            'title_similarity', Constants.Titles.THRESHOLD))
+        self.similar = list()
+        self.skipped_titles = set()
+        self.replacements = dict()
+
+        self.section = section
+
+        # when planning, nothing on the target is changed
+        self.planning = False
+
+        # imports of the asyncio API are planned one at a time
+        self.plan_lock = thr.Lock()
+
+    def set_rebuild_index(self, rebuild):
+        self.index.rebuild = rebuild
+
+    def set_file_operation(self):
+        self.operation, self.move = choose_operation(
+            self.src_path, self.stg_path, self.tgt_path,
+            self.copy, self.same_device_operation)
+
+        Output.log.message(f'file operation: {self.operation}')
+
+        if not same_device(self.stg_path, self.tgt_path):
+            Output.log.message('warning: stage and target are on '
+                               'different devices', level='warning')
+
+    @Output.metrics.timed('scan')
+    def list_files_on_source(self):
+        movies_folder = self.index.walk(self.src_path)
 
         all_files = list()
 
         for root, _, files in movies_folder:
-            for file in files:
+            for file, *_ in files:
                 all_files.append((root, file))
 
+        Output.metrics.add('scan', len(all_files))
+        Output.log.message(self.index.stats())
+        self.index.reset_stats()
+
         return all_files
 
-    @staticmethod
-    def list_files_on_target():
-        movies_folder = os.walk(MovieMover.tgt_path)
+    @Output.metrics.timed('scan')
+    def list_files_on_target(self):
+        movies_folder = self.index.walk(self.tgt_path)
 
         all_files = list()
 
         for root, _, files in movies_folder:
-            for file in files:
+            for file, *_ in files:
                 all_files.append((root, file))
 
+        Output.metrics.add('scan', len(all_files))
+        Output.log.message(self.index.stats())
+        self.index.reset_stats()
+
         return all_files
 
-    @staticmethod
-    def run_threads(changes):
-        def move_files_thread(old_path, new_path):
-            file_name = new_path.split("/")[-1]
-            old_name = old_path.split("/")[-1]
+    def stage_file(self, old_path, new_path, cancelled=None):
+        file_name = new_path.split("/")[-1]
+        old_name = old_path.split("/")[-1]
 
-            Output.log.message(f'[MOVE] {file_name} ({old_name})')
-            MovieMover.move(old_path, new_path)
-            Output.log.message(f'[DONE] {file_name}')
+        Output.log.message(f'[MOVE] {file_name} ({old_name})')
+        with Output.metrics.busy('stage'):
+            self.journal.transfer(self.move, old_path, new_path, cancelled)
+        self.fs.add_file(new_path)
+        Output.metrics.add_file('stage', new_path)
+        Output.log.message(f'[DONE] {file_name}')
 
-            return new_path
+        return new_path
 
+    @Output.metrics.timed('stage')
+    def run_threads(self, changes, promoter=None):
         results = list()
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            file_move_futures = (executor.submit(move_files_thread, old, new)
-                                 for old, new in changes)
+        self.journal.plan(changes)
 
-            for future in concurrent.futures.as_completed(file_move_futures):
-                try:
-                    result = future.result()
-                    results.append(result)
-                except KeyboardInterrupt:
-                    raise
-                except Exception as e:
-                    Output.log.message(e)
-                    MovieMover.remove_files((tgt for _, tgt in changes))
+        scheduler = self.scheduler
+        file_move_futures = scheduler.run(self.stage_file, changes,
+                                          cancel=self.journal.cancel)
+
+        for future in file_move_futures:
+            try:
+                result = future.result()
+                results.append(result)
+
+                if promoter is not None:
+                    promoter.submit(result)
+
+            except TransferCancelled:
+                continue
+            except Exception as e:
+                # the journal has already rolled back the failed file
+                Output.log.message(e, level='error')
 
         return results
 
+    def plan_move(self, old_path: str, new_name: str):
+        new_path = self.stg_path + '/' + new_name
+        target_path = self.tgt_path + '/' + new_name
+
+        # if file exists on target, skip it
+        if self.fs.isfile(target_path):
+            return None
+
+        # subtitles are skipped along with their movie
+        stem = new_name.split('.', 1)[0]
+        if stem in self.skipped_titles:
+            return None
+
+        # if it was already staged, only continue if the journal knows how
+        # far it got. otherwise, leave it alone
+        if self.fs.isfile(new_path) \
+                and self.journal.lookup(new_path) is None:
+            return None
+
+        size = self.index.size_of(old_path)
+
+        if self.duplicate_policy != 'copy':
+            duplicate = self.fingerprints.find_duplicate(
+                old_path, size, self.tgt_path)
+
+            if duplicate is not None:
+                self.handle_duplicate(old_path, target_path, duplicate)
+
+                # with link, the movie is on target under its new name,
+                # so its subtitles still go next to it
+                if self.duplicate_policy == 'skip':
+                    self.skipped_titles.add(stem)
+                return None
+
+        extension = new_name.rsplit('.', 1)[-1]
+        if extension not in Constants.SUBTITLE_EXTENSIONS:
+            similar = self.titles.match(new_name, exclude=target_path)
+
+            if similar is not None and not self.handle_similar(
+                    old_path, target_path, size, *similar):
+                self.skipped_titles.add(stem)
+                return None
+
+        return old_path, new_path, size
+
+    def handle_similar(self, old_path: str, target_path: str, size: int,
+                       existing: str, score: float) -> bool:
+        """decides what to do with a movie that's probably on target
+        already, returning True if it should still be copied"""
+        policy = self.similar_policy
+        keep = policy == 'keep_both'
+
+        if policy == 'replace_if_larger' \
+                and size > self.index.size_of(existing):
+            self.replacements[target_path] = existing
+            keep = True
+
+        action = ('replace' if target_path in self.replacements
+                  else 'keep both' if keep else 'skip')
+        self.similar.append((old_path, target_path, existing, score,
+                             action))
+
+        file_name = target_path.split('/')[-1]
+        Output.log.message(f'[PROBABLE EXISTING] {file_name} ({action})',
+                           f'|- tgt: {existing} ({score:.0%} similar)')
+
+        return keep
+
+    def retire_replaced(self, target_paths: list):
+        """removes the movies that were replaced by a larger copy, once
+        the new copy made it to the target"""
+        for target_path in target_paths:
+            existing = self.replacements.pop(target_path, None)
+            if existing is None:
+                continue
+
+            try:
+                os.remove(existing)
+                Output.log.message(f'[REPLACED] {existing}')
+            except OSError as e:
+                Output.log.message(e, level='error')
+
+    def handle_duplicate(self, old_path: str, target_path: str,
+                         duplicate: str):
+        self.duplicates.append((old_path, target_path, duplicate))
+
+        file_name = target_path.split('/')[-1]
+        Output.log.message(f'[DUPLICATE] {file_name}',
+                           f'|- src: {old_path}',
+                           f'|- tgt: {duplicate}')
+
+        if self.duplicate_policy == 'link' and not self.planning:
+            self.link_existing(duplicate, target_path)
+
     @staticmethod
-    def process_manifest(changes: list) -> list:
+    def link_existing(duplicate: str, target_path: str):
+        try:
+            os.link(duplicate, target_path)
+            Output.log.message(f'[LINKED] {target_path.split("/")[-1]}')
+        except OSError as e:
+            Output.log.message(e, level='error')
+
+    def index_target(self):
+        """brings the index of the target up to date and indexes its
+        titles, so planning can find movies that are already there under
+        another name"""
+        self.duplicates = list()
+        self.similar = list()
+        self.skipped_titles = set()
+
+        # replacements aren't reset, since an import of the asyncio API
+        # may still be promoting their new copies
+
+        target_files = self.list_files_on_target()
+        self.titles = TitleIndex.from_files(
+            target_files, self.titles.threshold)
+
+    @Output.metrics.timed('plan')
+    def process_manifest(self, changes: list) -> list:
         manifest = list()
 
         Output.log.header('processing manifest')
+        self.index_target()
 
-        for old_path, new_name in changes:
-            new_path = MovieMover.stg_path + '/' + new_name
-            target_path = MovieMover.tgt_path + '/' + new_name
+        # movies are planned before subtitles, so the subtitles of a
+        # movie that's skipped are skipped with it
+        for old_path, new_name in sorted(
+                changes, key=lambda change: change[1].rsplit('.', 1)[-1]
+                in Constants.SUBTITLE_EXTENSIONS):
+            job = self.plan_move(old_path, new_name)
+            if job is not None:
+                manifest.append(job)
 
-            # if file exists on target or was already staged, skip it
-            if os.path.isfile(target_path) or os.path.isfile(new_path):
-                continue
-
-            manifest.append((old_path, new_path))
+        manifest.sort(key=lambda job: job[1])
 
         if len(manifest) == 0:
             Output.log.header('no changes found')
         else:
             Output.log.header('deployment manifest')
-            for idx, (_, new_path) in enumerate(manifest):
-                Output.log.message(f'[{str(idx).zfill(2)}] {new_path}')
+            for idx, (_, new_path, size) in enumerate(manifest):
+                Output.log.message(f'[{str(idx).zfill(2)}] {new_path} '
+                                   f'({size / 1024 ** 2:,.1f} MB)')
             Output.log.divider()
 
+        self.report_duplicates()
+        Output.log.message(self.fs.report())
+
         return manifest
 
-    @staticmethod
-    def move_files_to_target():
-        results = list()
-        for root, _, files in os.walk(MovieMover.stg_path):
-            root = root.replace('\\', '/')
-            for file in files:
-                current_path = root + '/' + file
-                stg_path_with_tgt = (MovieMover.stg_path, MovieMover.tgt_path)
-                new_path = current_path.replace(*stg_path_with_tgt)
+    def report_duplicates(self):
+        if len(self.duplicates) > 0:
+            Output.log.header('already on target')
+            for idx, (_, target_path, duplicate) in enumerate(
+                    self.duplicates):
+                Output.log.message(f'[{str(idx).zfill(2)}] {target_path}',
+                                   f'|- same as: {duplicate}')
+            Output.log.divider()
 
-                try:
-                    os.rename(current_path, new_path)
-                    results.append(new_path)
-                except PermissionError:
-                    continue
+        if len(self.similar) > 0:
+            Output.log.header('probable existing')
+            for idx, (_, target_path, existing, score, action) in \
+                    enumerate(self.similar):
+                Output.log.message(f'[{str(idx).zfill(2)}] {target_path} '
+                                   f'({action})',
+                                   f'|- similar to: {existing} '
+                                   f'({score:.0%})')
+            Output.log.divider()
 
-        return results
+    def move_files_to_target(self, staged_paths):
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
+            for staged_path in staged_paths:
+                promoter.submit(staged_path)
 
-    @staticmethod
-    def clear_stage():
-        sh.rmtree(MovieMover.stg_path)
-        os.mkdir(MovieMover.stg_path)
+        return promoter.results
 
-    @staticmethod
-    def move_files(changes: list):
+    @Output.metrics.timed('clear_stage')
+    def clear_stage(self):
+        sh.rmtree(self.stg_path)
+        os.mkdir(self.stg_path)
+        self.fs.forget(self.stg_path)
+
+    def move_files(self, changes: list):
         """
             changes is a list of 2-tuples
             changes[n][0] contains the path of the file to be moved
             changes[n][1] contains the desired name of the file
+
+            the manifest built from it is a list of 3-tuples of
+            (source path, stage path, size in bytes)
         """
         changes = sorted(changes, key=lambda n: n[1])
 
-        manifest = MovieMover.process_manifest(changes)
+        manifest = self.process_manifest(changes)
         if len(manifest) == 0:
             Output.log.message('no changes found')
             return
 
         Output.log.message(f'{len(manifest)} movies found')
 
-        stage_results = MovieMover.run_threads(manifest)
-        Output.log.message(f'{len(stage_results)} movies moved to stage')
+        self.set_file_operation()
+
+        # each movie is promoted to the target as soon as it's staged
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
+            stage_results = self.run_threads(manifest, promoter)
+            Output.log.message(f'{len(stage_results)} movies moved to stage')
+            Output.log.message(self.scheduler.report())
+
+        self.finish_deployment(promoter)
+
+    def plan_files(self, changes: list) -> list:
+        """builds the manifest of move_files, and picks the file operation
+        if there's anything to move"""
+        with self.plan_lock:
+            manifest = self.process_manifest(
+                sorted(changes, key=lambda n: n[1]))
+
+            if len(manifest) > 0:
+                self.set_file_operation()
+
+        return manifest
 
-        target_results = MovieMover.move_files_to_target()
+    async def move_files_async(self, changes: list,
+                               progress=None) -> list:
+        """move_files for an asyncio event loop, eg. that of a webhook
+        server, returning the paths moved to the target
+
+        the blocking work runs on the shared transfer pool. cancelling the
+        task stops the files being copied and removes them; the movies
+        that were already staged are still promoted. events are sent to
+        progress, an aio.Progress, if given
+        """
+        # asyncio takes a while to import, so it's only imported here
+        from mediamanager.aio import AsyncDeployment
+
+        deployment = AsyncDeployment(self, checksums, progress)
+        manifest = list()
+
+        try:
+            async with deployment:
+                manifest = await deployment.call(self.plan_files, changes)
+                if len(manifest) == 0:
+                    return []
+
+                Output.log.message(f'{len(manifest)} movies found')
+                staged = await deployment.stage(self.stage_file, manifest)
+                Output.log.message(f'{len(staged)} movies moved to stage')
+        finally:
+            # also when cancelled, so the movies replaced by what was
+            # promoted are retired. other imports may be staging, so the
+            # stage isn't cleared
+            if len(manifest) > 0:
+                await deployment.call(self.finish_deployment,
+                                      deployment.promoter, False)
+
+        return deployment.promoter.results
+
+    def finish_deployment(self, promoter, clear_stage=True):
+        target_results = promoter.results
         Output.log.message(f'{len(target_results)} movies moved to target')
+        self.retire_replaced(target_results)
 
-        if len(stage_results) == len(target_results):
-            MovieMover.clear_stage()
+        if len(promoter.failed) == 0:
+            if clear_stage:
+                self.clear_stage()
             Output.log.header('deployment complete')
-
-        elif len(stage_results) > len(target_results):
-            missed_files = set(stage_results) | set(target_results)
-            error_count = len(missed_files)
+        else:
+            error_count = len(promoter.failed)
             Output.log.message(f'deployment failed for {error_count} files')
-            for idx, file in enumerate(missed_files):
+            for idx, file in enumerate(promoter.failed):
                 Output.log.message(f'[{str(idx).zfill(2)}]: {file}')
 
-        else:
-            # not expected to ever run, but just in case
-            extra_files = set(target_results) | set(stage_results)
-            extra_count = len(extra_files)
-            Output.log.message(f'deployment complete (w/{extra_count} extras)')
-            for idx, file in enumerate(extra_files):
-                Output.log.message(f'[{str(idx).zfill(2)}]: {file}')
+    def stream_files(self):
+        """scans, names, plans and stages movies in one pipeline, so the
+        first movie starts copying while the source is still being walked"""
+        Output.log.header('streaming deployment')
+        self.index_target()
+        self.set_file_operation()
+
+        def scan():
+            for root, _, files in self.index.walk(self.src_path):
+                yield [(root, file) for file, *_ in files]
+
+        def classify(directory):
+            videos, subtitles = self.search(directory)
+            if len(videos) > 0:
+                yield videos, subtitles
+
+        def rename(found):
+            yield from self.process_new_titles(*found)
+
+        def plan(change):
+            job = self.plan_move(*change)
+            if job is not None:
+                yield job
+
+        pipeline = (Pipeline(scan())
+                    .stage('classify', classify)
+                    .stage('rename', rename)
+                    .stage('plan', plan))
+
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
+            stage_results = list()
+            try:
+                # scanning, planning and staging overlap, so they're
+                # timed as one phase
+                with Output.metrics.phase('stream'):
+                    # the planned movies are staged through the scheduler
+                    # as they come, whatever is waiting in one run. the
+                    # stage phase times those runs, and counts their bytes
+                    for jobs in pipeline.batches():
+                        stage_results += self.run_threads(jobs, promoter)
+            except KeyboardInterrupt:
+                self.journal.cancel()
+                raise
+
+            Output.log.message(f'{len(stage_results)} movies moved to stage')
+
+        Output.log.message(pipeline.report())
+        Output.log.message(self.scheduler.report())
+        self.report_duplicates()
+        Output.log.message(self.index.stats())
+        Output.log.message(self.fs.report())
+        self.index.reset_stats()
+
+        if len(stage_results) == 0:
+            Output.log.header('no changes found')
+            return
+
+        self.finish_deployment(promoter)
+
+    def deploy_folders(self, folders: list):
+        """deploys the movies in the given folders (or files) of the
+        source as one batch"""
+        self.fs.clear()
+
+        all_files = list()
+        for folder in folders:
+            path = f'{self.src_path}/{folder}'
+
+            if os.path.isfile(path):
+                all_files.append((self.src_path, folder))
+                continue
+
+            # a file that grew after it was indexed doesn't change its
+            # folder's mtime, so the folder is listed again
+            self.index.forget(path)
+            for root, _, files in self.index.walk(path):
+                all_files.extend((root, file) for file, *_ in files)
+
+        if any(root == self.src_path for root, _ in all_files):
+            self.index.refresh(
+                self.src_path,
+                os.stat(self.src_path).st_mtime_ns)
+
+        videos, subtitles = self.search(all_files)
+        self.move_files(self.process_new_titles(videos, subtitles))
+        Output.metrics.export()
+
+    def watcher(self) -> Watcher:
+        """returns a watcher that deploys movies as they finish
+        downloading"""
+        return Watcher.from_config(self.section, self.deploy_folders)
+
+    def plan_paths(self) -> dict:
+        return {'src_path': self.src_path,
+                'stg_path': self.stg_path,
+                'tgt_path': self.tgt_path}
+
+    def save_plan(self, plan_path: str):
+        """plans a deployment like --batch would, writing it to plan_path
+        instead of running it"""
+        self.planning = True
+
+        all_files = self.list_files_on_source()
+        videos, subtitles = self.search(all_files)
+        changes = sorted(self.process_new_titles(videos, subtitles),
+                         key=lambda n: n[1])
+
+        manifest = self.process_manifest(changes)
+        self.set_file_operation()
+
+        counts = Plan(plan_path).write('movies', self.plan_paths(),
+                                       self.plan_entries(manifest))
+        self.planning = False
+
+        Output.log.message(f'plan written to {plan_path}: ' + ', '.join(
+            f'{count} {op}' for op, count in counts.items()))
+
+    def plan_entries(self, manifest: list):
+        similar = {target_path: (existing, score)
+                   for _, target_path, existing, score, _
+                   in self.similar}
+
+        for old_path, new_path, size in manifest:
+            target_path = self.tgt_path + '/' + new_path.split('/')[-1]
+            conflict = None
+            if target_path in similar:
+                existing, score = similar[target_path]
+                conflict = f'similar to {existing} ({score:.0%})'
+
+            _, mtime = self.index.stat_of(old_path)
+            yield Plan.entry(old_path, new_path, size, mtime,
+                             self.operation, conflict,
+                             replaces=self.replacements.get(
+                                 target_path))
+
+        for old_path, target_path, duplicate in self.duplicates:
+            op = 'link' if self.duplicate_policy == 'link' else 'skip'
+            size, mtime = self.index.stat_of(old_path)
+            yield Plan.entry(old_path, target_path, size, mtime, op,
+                             f'duplicate of {duplicate}', existing=duplicate)
+
+        for old_path, target_path, existing, score, action in \
+                self.similar:
+            if action == 'skip':
+                size, mtime = self.index.stat_of(old_path)
+                yield Plan.entry(old_path, target_path, size, mtime, 'skip',
+                                 f'similar to {existing} ({score:.0%})')
+
+    def apply_plan(self, plan_path: str):
+        """runs a plan written by save_plan, without rescanning the
+        source. raises PlanError if any source file changed since"""
+        plan = Plan(plan_path)
+        plan.check('movies', self.plan_paths())
+
+        Output.log.header('applying plan')
+        self.replacements = dict()
+
+        manifest = list()
+        for entry in plan.entries():
+            op, new_path = entry['op'], entry['dst']
+
+            if op == 'skip':
+                Output.log.message(f'[SKIP] {new_path.split("/")[-1]} '
+                                   f'({entry.get("conflict")})')
+            elif op == 'link':
+                self.link_existing(entry['existing'], new_path)
+            else:
+                self.operation = op
+                self.move = operation_by_name(op, self.copy)
+
+                if 'replaces' in entry:
+                    target_path = (self.tgt_path + '/'
+                                   + new_path.split('/')[-1])
+                    self.replacements[target_path] = entry['replaces']
+
+                manifest.append((entry['src'], new_path, entry['size']))
+
+        if len(manifest) == 0:
+            Output.log.header('no changes found')
+            return
+
+        Output.log.message(f'{len(manifest)} movies found',
+                           f'file operation: {self.operation}')
+
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
+            stage_results = self.run_threads(manifest, promoter)
+            Output.log.message(f'{len(stage_results)} movies moved to stage')
+            Output.log.message(self.scheduler.report())
+
+        self.finish_deployment(promoter)
 
     @staticmethod
     def search(all_files: list, preferred_only=False) -> list:
@@ -179,7 +653,7 @@ class MovieMover(FileMover):
 
         for path, file in all_files:
             file = file.lower()
-            extension_match = re.search(r'^(.+)\.([a-z0-9]{2,4})$', file)
+            extension_match = NameCleaner.FILE_EXTENSION.search(file)
             if not extension_match:
                 continue
 
@@ -203,64 +677,89 @@ class MovieMover(FileMover):
         return video_files, subtitle_files
 
     @staticmethod
+    @Output.metrics.timed('plan')
     def process_new_titles(video_files: list, subtitle_files: list) -> list:
         name_changes = []
 
+        sidecars = SidecarIndex.from_files(
+            (sub_path, f'{sub_file}.{sub_ext}')
+            for sub_path, sub_file, sub_ext in subtitle_files)
+
         for path, file, ext in video_files:
             new_name = NameCleaner.movie_name(file)
 
-            if new_name == '.' + ext:
+            if new_name is None or new_name == '.' + ext:
                 continue
 
-            sub_name = None
-            for sub_path, sub_file, sub_ext in subtitle_files:
-                if sub_file == file:
-                    sub_name = sub_file + '.' + sub_ext
-                    break
-
             name_changes.append((f'{path}/{file}.{ext}', f'{new_name}.{ext}'))
 
-            if sub_name:
-                new_sub_name = f'{new_name}.eng.{sub_ext}'
-                name_changes.append((f'{sub_path}/{sub_name}', new_sub_name))
+            # subtitles without a language are assumed to be english
+            for sub_path, language, sub_ext in sidecars.lookup(
+                    path, file, any_directory=True):
+                new_sub_name = SidecarIndex.sidecar_name(
+                    new_name, language or 'eng', sub_ext)
+                name_changes.append((sub_path, new_sub_name))
 
         return name_changes
 
 
 class TvMover(FileMover):
+    """Deploys one tv library, eg. the [tv] or [tv.anime] section of the
+    config"""
 
-    src_path = config['tv']['src_path'].replace('\\', '/')
-    stg_path = config['tv']['stg_path'].replace('\\', '/')
-    tgt_path = config['tv']['tgt_path'].replace('\\', '/')
+    index = scan_index
+    journal = transfer_journal
+    fs = fs_cache
 
-    move = sh.copyfile
+    def __init__(self, section):
+        self.name = section.name
 
-    overwrite = False
+        self.src_path = section['src_path'].replace('\\', '/')
+        self.stg_path = section['stg_path'].replace('\\', '/')
+        self.tgt_path = section['tgt_path'].replace('\\', '/')
 
-    @staticmethod
-    def list_tv_shows_on_source():
-        return os.listdir(TvMover.src_path)
+        self.copy = CopyEngine.from_config(section, checksums)
+        self.move = self.copy
 
-    @staticmethod
-    def list_tv_shows_on_target():
-        return os.listdir(TvMover.tgt_path)
+        self.scheduler = IoScheduler.from_config(section, transfer_pool)
 
-    @staticmethod
-    def get_tv_show_files(tv_show_folder_name: str):
-        tv_show_folder_name = f'{TvMover.src_path}/{tv_show_folder_name}'
-        tv_show_folder = os.walk(tv_show_folder_name)
+        self.same_device_operation = section.get(
+            'same_device_operation',
+            Constants.Transfer.SAME_DEVICE_OPERATION)
+        self.operation = None
+
+        self.overwrite = False
+
+        self.concurrent_shows = section.getint(
+            'concurrent_shows', Constants.Tv.CONCURRENT_SHOWS)
+        self.planning_workers = section.getint(
+            'planning_workers', Constants.Tv.PLANNING_WORKERS)
+
+        self.section = section
+
+        # when planning, no folders are created
+        self.planning = False
+
+    def list_tv_shows_on_source(self):
+        return os.listdir(self.src_path)
+
+    def list_tv_shows_on_target(self):
+        return os.listdir(self.tgt_path)
+
+    @Output.metrics.timed('scan')
+    def get_tv_show_files(self, tv_show_folder_name: str, path=None):
+        path = path if path is not None else self.src_path
+        tv_show_folder_name = f'{path}/{tv_show_folder_name}'
+        tv_show_folder = self.index.walk(tv_show_folder_name)
 
         tv_show = []
         for root, _, files in tv_show_folder:
-            try:
-                season_folder = str(re.split(r'[\\\/]+', root)[::-1][0])
-            except IndexError:
-                continue
+            season_folder = root.rsplit('/', 1)[-1]
 
-            season_num_match = re.search(r'[sS](\d+)', season_folder)
+            season_num_match = NameCleaner.SEASON_FOLDER.search(season_folder)
             if not season_num_match:
                 season_num_match = \
-                    re.search(r'[sS]eason[ ._-](\d+)', season_folder)
+                    NameCleaner.SEASON_FOLDER_LONG.search(season_folder)
 
             if season_num_match:
                 season_num = season_num_match.group(1)
@@ -269,64 +768,73 @@ class TvMover(FileMover):
             else:
                 season = 's00'
 
-            tv_show = tv_show + [(root, season, f) for f in files]
+            tv_show.extend((root, season, file) for file, *_ in files)
 
+        Output.metrics.add('scan', len(tv_show))
         return tv_show
 
-    @staticmethod
-    def allocate_space_for_show(tv_show_name: str):
-        try:
-            os.makedirs(f'{TvMover.stg_path}/{tv_show_name}')
-        except FileExistsError:
-            pass
+    def allocate_space_for_show(self, tv_show_name: str):
+        if self.planning:
+            return
 
-        try:
-            os.makedirs(f'{TvMover.tgt_path}/{tv_show_name}')
-        except FileExistsError:
-            pass
+        self.fs.makedirs(f'{self.stg_path}/{tv_show_name}')
+        self.fs.makedirs(f'{self.tgt_path}/{tv_show_name}')
 
-    @staticmethod
-    def allocate_space_for_season(tv_show_name: str, season: str):
-        try:
-            os.makedirs(f'{TvMover.stg_path}/{tv_show_name}/{season}')
-        except FileExistsError:
-            pass
+    def allocate_space_for_season(self, tv_show_name: str, season: str):
+        if self.planning:
+            return
 
-        try:
-            os.makedirs(f'{TvMover.tgt_path}/{tv_show_name}/{season}')
-        except FileExistsError:
-            pass
+        self.fs.makedirs(f'{self.stg_path}/{tv_show_name}/{season}')
+        self.fs.makedirs(f'{self.tgt_path}/{tv_show_name}/{season}')
 
-    @staticmethod
-    def create_specials_folder(tv_show_name: str):
-        try:
-            os.makedirs(f'{TvMover.stg_path}/{tv_show_name}/s00')
-        except FileExistsError:
-            pass
+    def create_specials_folder(self, tv_show_name: str):
+        self.fs.makedirs(f'{self.stg_path}/{tv_show_name}/s00')
+        self.fs.makedirs(f'{self.tgt_path}/{tv_show_name}/s00')
 
-        try:
-            os.makedirs(f'{TvMover.tgt_path}/{tv_show_name}/s00')
-        except FileExistsError:
-            pass
+    @Output.metrics.timed('clear_stage')
+    def clear_stage(self, tv_show: str):
+        sh.rmtree(self.stg_path + '/' + tv_show)
+        self.fs.forget(self.stg_path + '/' + tv_show)
 
-    @staticmethod
-    def clear_stage(tv_show: str):
-        sh.rmtree(TvMover.stg_path + '/' + tv_show)
+    def finish_show(self, tv_show: str, failed: list):
+        """clears the show's stage, unless some of its files couldn't be
+        promoted, since with rename the staged files are the only copies"""
+        prefix = f'{self.stg_path}/{tv_show}/'
+        failed = [path for path in failed
+                  if path.replace('\\', '/').startswith(prefix)]
+
+        if len(failed) == 0:
+            self.clear_stage(tv_show)
+            return
+
+        Output.log.message(f'deployment failed for {len(failed)} files, '
+                           'leaving them on stage', level='error')
+        for idx, file in enumerate(failed):
+            Output.log.message(f'[{str(idx).zfill(2)}]: {file}')
 
     @staticmethod
     def paths_are_equal(old_path: str, new_path: str) -> bool:
         return os.path.normpath(old_path) == os.path.normpath(new_path)
 
-    @staticmethod
-    def set_overwrite(overwrite):
-        TvMover.overwrite = overwrite
+    def set_overwrite(self, overwrite):
+        self.overwrite = overwrite
 
-    @staticmethod
-    def set_file_operation(path):
-        if TvMover.tgt_path == os.path.normpath(path):
-            TvMover.move = os.rename
+    def set_rebuild_index(self, rebuild):
+        self.index.rebuild = rebuild
+
+    def set_file_operation(self, path):
+        if self.tgt_path == os.path.normpath(path):
+            operation, self.move = 'rename', os.rename
         else:
-            TvMover.move = sh.copyfile
+            operation, self.move = choose_operation(
+                path, self.stg_path, self.tgt_path,
+                self.copy, self.same_device_operation)
+
+        # clean_tv_show sets the operation for every show,
+        # so only log it when it changes
+        if operation != self.operation:
+            self.operation = operation
+            Output.log.message(f'file operation: {operation}')
 
     @staticmethod
     def remove_files(paths):
@@ -336,136 +844,518 @@ class TvMover(FileMover):
             except FileNotFoundError:
                 continue
 
-    @staticmethod
-    def move_tv_shows(tv_shows: list):
+    def move_tv_shows(self, tv_shows: list):
         for tv_show in tv_shows:
-            episodes, specials = TvMover.clean_tv_show(tv_show)
+            episodes, specials = self.clean_tv_show(tv_show)
+            self.deploy_show(tv_show, episodes, specials)
 
-            if len(episodes) == 0 and len(specials) == 0:
-                continue
+        Output.log.message(self.scheduler.report())
+        Output.log.message(self.index.stats())
+        Output.log.message(self.fs.report())
+        self.index.reset_stats()
+
+    def deploy_shows(self, tv_shows: list):
+        """deploys the given shows of the source, each as one batch"""
+        self.fs.clear()
+
+        # a file that grew after it was indexed doesn't change its
+        # folder's mtime, so the shows are listed again
+        for tv_show in tv_shows:
+            self.index.forget(f'{self.src_path}/{tv_show}')
+
+        self.move_tv_shows([tv_show for tv_show in tv_shows
+                            if os.path.isdir(f'{self.src_path}/{tv_show}')])
+        Output.metrics.export()
+
+    def watcher(self) -> Watcher:
+        """returns a watcher that deploys episodes as they finish
+        downloading"""
+        return Watcher.from_config(self.section, self.deploy_shows)
+
+    async def move_tv_shows_async(self, tv_shows: list,
+                                  progress=None) -> list:
+        """move_tv_shows for an asyncio event loop, eg. that of a webhook
+        server, returning the paths moved to the target
+
+        the blocking work runs on the shared transfer pool. cancelling the
+        task stops the files being copied and removes them; the episodes
+        that were already staged are still promoted. events are sent to
+        progress, an aio.Progress, if given
+        """
+        from mediamanager.aio import AsyncDeployment
+
+        async with AsyncDeployment(self, checksums, progress) as deployment:
+            for tv_show in tv_shows:
+                episodes, specials = await deployment.call(
+                    self.clean_tv_show, tv_show)
+                if len(episodes) == 0 and len(specials) == 0:
+                    continue
+
+                Output.log.header(tv_show)
 
-            Output.log.header(tv_show)
+                try:
+                    if len(episodes) > 0:
+                        Output.log.message(f'{len(episodes)} episodes found')
+                        staged = await deployment.stage(self.stage_episode,
+                                                        episodes)
+                        Output.log.message(f'{len(staged)} episodes moved '
+                                           'to stage')
+
+                    if len(specials) > 0:
+                        await deployment.call(self.create_specials_folder,
+                                              tv_show)
+                        Output.log.message('moving oddly-named files to s00')
+                        await deployment.stage(self.stage_special, specials)
+                finally:
+                    # the show's stage is only cleared once what was staged
+                    # is promoted, also when the import is cancelled, and
+                    # not at all if some of it couldn't be
+                    await deployment.drain()
+                    await deployment.call(self.finish_show, tv_show,
+                                          deployment.promoter.failed)
+
+        Output.log.message(self.scheduler.report())
+        return deployment.promoter.results
+
+    def deploy_show(self, tv_show: str, episodes: list, specials: list):
+        if len(episodes) == 0 and len(specials) == 0:
+            return
 
+        Output.log.header(tv_show)
+
+        # each episode is promoted to the target as soon as it's staged
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
             if len(episodes) > 0:
-                TvMover.move_files_to_stage(episodes)
+                self.move_files_to_stage(episodes, promoter)
 
             if len(specials) > 0:
-                TvMover.create_specials_folder(tv_show)
-                TvMover.move_specials(specials)
+                self.create_specials_folder(tv_show)
+                self.move_specials(specials, promoter)
+
+        self.finish_show(tv_show, promoter.failed)
+
+    def plan_paths(self) -> dict:
+        return {'src_path': self.src_path,
+                'stg_path': self.stg_path,
+                'tgt_path': self.tgt_path}
+
+    def save_plan(self, plan_path: str, tv_shows: list):
+        """plans the deployment of tv_shows, writing it to plan_path
+        instead of running it"""
+        self.planning = True
+        counts = Plan(plan_path).write('tv', self.plan_paths(),
+                                       self.plan_entries(tv_shows))
+        self.planning = False
+
+        Output.log.message(f'plan written to {plan_path}: ' + ', '.join(
+            f'{count} {op}' for op, count in counts.items()))
+        Output.log.message(self.index.stats())
+        Output.log.message(self.fs.report())
+        self.index.reset_stats()
+
+    def plan_entries(self, tv_shows: list):
+        for tv_show in tv_shows:
+            episodes, specials = self.clean_tv_show(tv_show)
+            tv_show = NameCleaner.tv_show_name(tv_show)
+            planned = set()
+
+            for jobs, special in ((episodes, None), (specials, True)):
+                for old_path, new_path, size in jobs:
+                    target_path = new_path.replace(self.stg_path,
+                                                   self.tgt_path, 1)
+                    op, conflict = self.operation, None
+
+                    if new_path in planned:
+                        op, conflict = 'skip', 'planned twice'
+                    elif not self.overwrite \
+                            and self.fs.isfile(target_path):
+                        op, conflict = 'skip', 'target exists'
+
+                    planned.add(new_path)
+
+                    _, mtime = self.index.stat_of(old_path)
+                    yield Plan.entry(old_path, new_path, size, mtime, op,
+                                     conflict, group=tv_show,
+                                     special=special)
+
+    def apply_plan(self, plan_path: str):
+        """runs a plan written by save_plan, without rescanning the
+        source. raises PlanError if any source file changed since"""
+        plan = Plan(plan_path)
+        plan.check('tv', self.plan_paths())
+
+        Output.log.header('applying plan')
+
+        for tv_show, entries in plan.groups():
+            episodes, specials = list(), list()
+
+            for entry in entries:
+                op, new_path = entry['op'], entry['dst']
+
+                if op == 'skip':
+                    Output.log.message(f'[SKIP] {new_path.split("/")[-1]} '
+                                       f'({entry.get("conflict")})')
+                    continue
 
-            TvMover.move_files_to_target()
-            TvMover.clear_stage(tv_show)
+                if op != self.operation:
+                    self.operation = op
+                    self.move = operation_by_name(op, self.copy)
+                    Output.log.message(f'file operation: {op}')
 
-    @staticmethod
-    def run_threads(changes):
-        def move_files_thread(old_path, new_path):
-            target_path = new_path.replace(TvMover.stg_path, TvMover.tgt_path)
+                for path in (self.stg_path, self.tgt_path):
+                    self.fs.makedirs(os.path.dirname(new_path.replace(
+                        self.stg_path, path, 1)))
 
-            # if file exists on target and overwriting is disabled, skip it
-            if not TvMover.overwrite and os.path.isfile(target_path):
-                return None
+                job = (entry['src'], new_path, entry['size'])
+                (specials if entry.get('special') else episodes).append(job)
 
-            file_name = new_path.split("/")[-1]
+            self.deploy_show(tv_show, episodes, specials)
 
-            old_path = os.path.normpath(old_path)
-            new_path = os.path.normpath(new_path)
+        Output.log.message(self.scheduler.report())
 
-            Output.log.message(f'[STAGE] {file_name}',
-                               f'|- src: {old_path}',
-                               f'|- tgt: {new_path}')
+    def move_tv_shows_concurrently(self, tv_shows: list):
+        """like move_tv_shows, but the next shows are planned while the
+        episodes of earlier ones transfer. the shows in flight stage through
+        the scheduler, so they share its per device limits and the transfer
+        pool. each show's stage is cleared once it's done, and its log is
+        held back until then so it's written in one piece"""
+        in_flight = thr.Semaphore(max(1, self.concurrent_shows))
+        deployers = list()
 
-            TvMover.move(old_path, new_path)
-            Output.log.message(f'[DONE] {file_name}')
+        def finish(tv_show):
+            Output.log.release(tv_show)
+            in_flight.release()
 
-            return new_path
+        def deploy(tv_show, jobs):
+            try:
+                with Output.log.group(tv_show):
+                    Output.log.message(f'{len(jobs)} episodes found')
 
-        results = list()
+                    with Promoter(self.stg_path, self.tgt_path,
+                                  self.journal, checksums, group=tv_show,
+                                  fs=self.fs) as promoter:
+                        self.run_threads(jobs, promoter, group=tv_show)
+
+                    Output.log.message(f'{len(promoter.results)} episodes '
+                                       f'moved to target')
+                    self.finish_show(tv_show, promoter.failed)
+            except Exception as e:
+                with Output.log.group(tv_show):
+                    Output.log.message(e, level='error')
+            finally:
+                finish(tv_show)
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            file_move_futures = (executor.submit(move_files_thread, old, new)
-                                 for old, new in changes)
+        try:
+            for tv_show in tv_shows:
+                in_flight.acquire()
 
-            for future in concurrent.futures.as_completed(file_move_futures):
+                # one show that can't be planned mustn't stop the others
                 try:
-                    result = future.result()
+                    with Output.log.group(tv_show):
+                        Output.log.header(tv_show)
+                        episodes, specials = self.clean_tv_show(tv_show)
+                        if len(specials) > 0:
+                            self.create_specials_folder(tv_show)
+                except Exception as e:
+                    with Output.log.group(tv_show):
+                        Output.log.message(e, level='error')
+                    finish(tv_show)
+                    continue
 
-                    if result is None:
-                        continue
+                if len(episodes) == 0 and len(specials) == 0:
+                    finish(tv_show)
+                    continue
 
-                    results.append(result)
+                deployer = thr.Thread(target=deploy,
+                                      args=(tv_show, episodes + specials),
+                                      daemon=True)
+                deployer.start()
+                deployers.append(deployer)
+
+            for deployer in deployers:
+                deployer.join()
+
+        except KeyboardInterrupt:
+            self.journal.cancel()
+            for deployer in deployers:
+                deployer.join()
+            raise
+
+        Output.log.message(self.scheduler.report())
+        Output.log.message(self.index.stats())
+        Output.log.message(self.fs.report())
+        self.index.reset_stats()
+
+    def is_deployed(self, new_path: str) -> bool:
+        """whether the episode staged at new_path is on target already,
+        and is to be left alone"""
+        target_path = new_path.replace(self.stg_path, self.tgt_path)
+        return not self.overwrite and self.fs.isfile(target_path)
+
+    def stage_episode(self, old_path: str, new_path: str, cancelled=None):
+        # if file exists on target and overwriting is disabled, skip it
+        if self.is_deployed(new_path):
+            # the asyncio API journals every episode it's given
+            self.journal.forget(new_path)
+            return None
+
+        file_name = new_path.split("/")[-1]
+
+        Output.log.message(f'[STAGE] {file_name}',
+                           f'|- src: {os.path.normpath(old_path)}',
+                           f'|- tgt: {os.path.normpath(new_path)}')
+
+        with Output.metrics.busy('stage'):
+            self.journal.transfer(self.move, old_path, new_path, cancelled)
+        self.fs.add_file(new_path)
+        Output.metrics.add_file('stage', new_path)
+        Output.log.message(f'[DONE] {file_name}')
+
+        return new_path
+
+    @Output.metrics.timed('stage')
+    def run_threads(self, changes, promoter=None, group: str = None):
+        results = list()
 
-                    if len(results) % 5 == 0:
-                        Output.log.message('checkpoint reached')
-                        TvMover.move_files_to_target()
+        # episodes on target already aren't journaled (which stats their
+        # source), and the rows earlier runs left for them are dropped
+        deployed = {job[1] for job in changes if self.is_deployed(job[1])}
+        self.journal.forget(*deployed)
+        changes = [job for job in changes if job[1] not in deployed]
 
-                except KeyboardInterrupt:
-                    raise
-                except Exception as e:
-                    Output.log.message(e)
-                    TvMover.remove_files((tgt for _, tgt in changes))
+        self.journal.plan(changes)
 
-        return results
+        def stage(old_path, new_path):
+            # the pool's threads log under the show's group, if any
+            with Output.log.group(group):
+                return self.stage_episode(old_path, new_path)
 
-    @staticmethod
-    def move_files_to_target():
-        for root, _, files in os.walk(TvMover.stg_path):
-            root = root.replace('\\', '/')
-            for file in files:
-                current_path = root + '/' + file
-                stg_path_with_tgt_path = (TvMover.stg_path, TvMover.tgt_path)
-                new_path = current_path.replace(*stg_path_with_tgt_path)
+        scheduler = self.scheduler
+        file_move_futures = scheduler.run(stage, changes,
+                                          cancel=self.journal.cancel)
+
+        for future in file_move_futures:
+            try:
+                result = future.result()
+
+                if result is None:
+                    continue
 
-                Output.log.message(f'[FINISH] {file}',
-                                   f'|- stg: {current_path}',
-                                   f'|- tgt: {new_path}\n')
+                results.append(result)
 
-                os.rename(current_path, new_path)
+                if promoter is not None:
+                    promoter.submit(result)
 
-    @staticmethod
-    def move_files_to_stage(changes):
+            except TransferCancelled:
+                continue
+            except Exception as e:
+                # the journal has already rolled back the failed file
+                Output.log.message(e, level='error')
+
+        return results
+
+    def move_files_to_target(self, staged_paths):
+        with Promoter(self.stg_path, self.tgt_path,
+                      self.journal, checksums, fs=self.fs) as promoter:
+            for staged_path in staged_paths:
+                promoter.submit(staged_path)
+
+        return promoter.results
+
+    def move_files_to_stage(self, changes, promoter=None):
         Output.log.message(f'{len(changes)} episodes found')
-        results = TvMover.run_threads(changes)
+        results = self.run_threads(changes, promoter)
 
         if len(results) > 0:
             Output.log.message(f'{len(results)} episodes moved to stage')
         else:
             Output.log.message('no changes')
 
-    @staticmethod
-    def move_specials(odd_names):
+    @Output.metrics.timed('stage')
+    def move_specials(self, odd_names, promoter=None):
         Output.log.message('moving oddly-named files to s00')
-        for old_path, new_path in odd_names:
+        for old_path, new_path, _ in odd_names:
             try:
-                file_name = new_path.split("/")[-1]
-                old_name = old_path.split("/")[-1]
+                self.stage_special(old_path, new_path)
 
-                Output.log.message(f'[MOVE] {file_name} ({old_name})')
-                TvMover.move(old_path, new_path)
-                Output.log.message(f'[DONE] {file_name}')
+                if promoter is not None:
+                    promoter.submit(new_path)
 
             except KeyboardInterrupt:
                 raise
             except Exception as e:
-                Output.log.message(str(e))
+                Output.log.message(e, level='error')
                 continue
 
-    @staticmethod
-    def clean_tv_show(tv_show_name: str, path=None):
-        path = path if path is not None else TvMover.src_path
+    def stage_special(self, old_path: str, new_path: str, cancelled=None):
+        file_name = new_path.split("/")[-1]
+        old_name = old_path.split("/")[-1]
+
+        Output.log.message(f'[MOVE] {file_name} ({old_name})')
+        with Output.metrics.busy('stage'):
+            self.journal.transfer(self.move, old_path, new_path, cancelled)
+        Output.metrics.add_file('stage', new_path)
+        Output.log.message(f'[DONE] {file_name}')
+
+        return new_path
+
+    @Output.metrics.timed('plan')
+    def clean_tv_show(self, tv_show_name: str, path=None):
+        path = path if path is not None else self.src_path
 
         tv_show_name = NameCleaner.tv_show_name(tv_show_name)
 
-        TvMover.set_file_operation(path)
-        TvMover.allocate_space_for_show(tv_show_name)
+        self.set_file_operation(path)
+        self.allocate_space_for_show(tv_show_name)
+
+        tv_show = self.get_tv_show_files(tv_show_name)
+        changes, odd_names = self.plan_tv_show(tv_show_name, tv_show,
+                                               self.stg_path)
 
-        tv_show = TvMover.get_tv_show_files(tv_show_name)
+        # create a folder for each season on the stage and the target
+        for season in {new_path.rsplit('/', 2)[-2]
+                       for _, new_path in changes}:
+            self.allocate_space_for_season(tv_show_name, season)
+
+        changes = [(old_path, new_path, self.index.size_of(old_path))
+                   for old_path, new_path in changes]
+        odd_names = [(old_path, new_path, self.index.size_of(old_path))
+                     for old_path, new_path in odd_names]
+
+        return changes, odd_names
 
+    @Output.metrics.timed('plan')
+    def plan_target_cleanup(self, tv_shows: list = None):
+        """plans the renames that clean up the shows already on the
+        target, returning (renames, conflicts)
+
+        shows are listed here, named on a pool of processes, then checked
+        for collisions across the whole library. a conflict is a
+        (old path, new path, reason) that mustn't be renamed. swaps and
+        chains of renames aren't conflicts, clean_target orders them
+        """
+        if tv_shows is None:
+            tv_shows = self.list_tv_shows_on_target()
+
+        Output.log.header('planning target cleanup')
+
+        names = [NameCleaner.tv_show_name(tv_show) for tv_show in tv_shows]
+        listings = [self.get_tv_show_files(tv_show, self.tgt_path)
+                    for tv_show in tv_shows]
+
+        Output.log.message(f'{len(tv_shows)} shows listed',
+                           self.index.stats())
+        self.index.reset_stats()
+
+        # spawned workers don't inherit the threads and open files of this
+        # process, which a forked worker could deadlock on
+        with concurrent.futures.ProcessPoolExecutor(
+                self.planning_workers,
+                mp_context=mp.get_context('spawn')) as executor:
+            plans = executor.map(self.plan_tv_show, names, listings,
+                                 itertools.repeat(self.tgt_path),
+                                 chunksize=16)
+
+            renames = [rename for changes, odd_names in plans
+                       for rename in changes + odd_names]
+
+        graph = RenameGraph(renames)
+        renames, conflicts = graph.renames, graph.conflicts
+
+        Output.log.message(f'{len(renames)} files to rename, '
+                           f'{len(conflicts)} conflicts')
+
+        return renames, conflicts
+
+    def save_cleanup_plan(self, plan_path: str):
+        """plans a target cleanup, writing it to plan_path instead of
+        renaming anything"""
+        renames, conflicts = self.plan_target_cleanup()
+
+        def entries():
+            for old_path, new_path in renames:
+                size, mtime = self.index.stat_of(old_path)
+                yield Plan.entry(old_path, new_path, size, mtime, 'rename')
+
+            for old_path, new_path, reason in conflicts:
+                size, mtime = self.index.stat_of(old_path)
+                yield Plan.entry(old_path, new_path, size, mtime, 'skip',
+                                 reason)
+
+        counts = Plan(plan_path).write('tv-cleanup',
+                                       {'tgt_path': self.tgt_path},
+                                       entries())
+
+        Output.log.message(f'plan written to {plan_path}: ' + ', '.join(
+            f'{count} {op}' for op, count in counts.items()))
+
+    def apply_cleanup_plan(self, plan_path: str):
+        """runs a plan written by save_cleanup_plan. raises PlanError if
+        any file changed since"""
+        plan = Plan(plan_path)
+        plan.check('tv-cleanup', {'tgt_path': self.tgt_path})
+
+        Output.log.header('applying target cleanup')
+
+        renames = list()
+        conflicts = list()
+        for entry in plan.entries():
+            if entry['op'] == 'skip':
+                conflicts.append((entry['src'], entry['dst'],
+                                  entry.get('conflict')))
+            else:
+                renames.append((entry['src'], entry['dst']))
+
+        self.clean_target(renames, conflicts)
+
+    @Output.metrics.timed('rename')
+    def clean_target(self, renames: list, conflicts: list = ()):
+        """applies renames planned by plan_target_cleanup in one pass,
+        ordered so that no rename overwrites another file"""
+        graph = RenameGraph(renames)
+        graph.conflicts = list(conflicts) + graph.conflicts
+
+        for old_path, new_path, reason in graph.conflicts:
+            Output.log.message(f'[CONFLICT] {new_path} ({reason})',
+                               f'|- src: {old_path}', level='warning')
+
+        graph.run()
+        Output.log.message(graph.report())
+
+    @staticmethod
+    def plan_tv_show(tv_show_name: str, tv_show: list, path: str):
+        """names the files of a show beneath path, returning the
+        (old path, new path) of its episodes and of its oddly-named files
+
+        only works on the (root, season, file) listing it's given, so it
+        can run in another process
+        """
         changes = []
         odd_names = []
 
+        video_extensions = (Constants.PREFERRED_VIDEO_EXTENSIONS
+                            .union(Constants.OTHER_VIDEO_EXTENSIONS))
+        valid_extensions = video_extensions.union(
+            Constants.SUBTITLE_EXTENSIONS)
+
+        # subtitles are moved along with the video they belong to
+        sidecars = SidecarIndex.from_files((root, f) for root, _, f in tv_show)
+        video_stems = set()
+        for root, _, episode in tv_show:
+            match = NameCleaner.FILE_EXTENSION.search(episode)
+            if (match and episode[0] != '.'
+                    and match.group(2).lower() in video_extensions):
+                video_stems.add((root, match.group(1).lower()))
+
         for root, season, episode in tv_show:
             old_episode_name = episode
 
+            sidecar = SidecarIndex.split(episode)
+            if sidecar is not None and any((root, stem) in video_stems
+                                           for stem, _ in sidecar[0]):
+                continue
+
             # skip hidden files
             if episode[0] == '.' or not re.match(r's\d+', season):
                 continue
@@ -476,21 +1366,14 @@ class TvMover(FileMover):
             if season_num is not None and season_num != season:
                 season = season_num
 
-            # create a folder for the season on the stage and the target
-            TvMover.allocate_space_for_season(tv_show_name, season)
-
-            episode_match = re.search(Constants.Tv.EPISODE_REGEX, episode)
-            episode_ext_match = re.search(r'^.+\.([a-z0-9]{2,4})$', episode)
+            episode_match = NameCleaner.EPISODE.search(episode)
+            episode_ext_match = NameCleaner.FILE_EXTENSION.search(episode)
 
             # if no extension can be determined, move on
             if not episode_ext_match:
                 continue
 
-            episode_ext = episode_ext_match.group(1).lower()
-
-            valid_extensions = (Constants.PREFERRED_VIDEO_EXTENSIONS
-                                .union(Constants.OTHER_VIDEO_EXTENSIONS)
-                                .union(Constants.SUBTITLE_EXTENSIONS))
+            episode_ext = episode_ext_match.group(2).lower()
 
             # if an extension is found, but is not a valid extension, move on
             if episode_ext not in valid_extensions:
@@ -501,20 +1384,49 @@ class TvMover(FileMover):
                 new_name = NameCleaner.name_special_file(episode)
 
                 old_path = root + '/' + episode
-                new_path = f'{TvMover.stg_path}/{tv_show_name}/s00/{new_name}'
+                new_path = f'{path}/{tv_show_name}/s00/{new_name}'
 
                 odd_names.append((old_path, new_path))
+                odd_names.extend(TvMover.plan_sidecars(root, episode,
+                                                       new_path, sidecars))
                 continue
 
             # if an episode number was found, finalize the name changes to
-            # {stage directory}/{tv show name}/sXX/sXXeXX.{extension}"
+            # {path}/{tv show name}/sXX/sXXeXX.{extension}"
             episode = NameCleaner.parse_episode_match(episode_match, season)
 
-            new_path = (f'{TvMover.stg_path}/{tv_show_name}/{season}/'
+            new_path = (f'{path}/{tv_show_name}/{season}/'
                         f'{episode}.{episode_ext}')
             old_path = root + '/' + old_episode_name
 
             if not TvMover.paths_are_equal(old_path, new_path):
                 changes.append((old_path, new_path))
 
+            changes.extend(TvMover.plan_sidecars(root, old_episode_name,
+                                                 new_path, sidecars))
+
         return changes, odd_names
+
+    @staticmethod
+    def plan_sidecars(root: str, episode: str, new_path: str,
+                      sidecars: SidecarIndex) -> list:
+        """names the subtitles of an episode after its new path"""
+        stem = NameCleaner.FILE_EXTENSION.search(episode)
+        if not stem:
+            return []
+
+        new_stem = new_path.rsplit('.', 1)[0]
+
+        changes = []
+        for sub_path, language, sub_ext in sidecars.lookup(root,
+                                                           stem.group(1)):
+            # a subtitle that's named on its own is its own sidecar
+            if sub_path == f'{root}/{episode}':
+                continue
+
+            new_sub_path = SidecarIndex.sidecar_name(new_stem, language,
+                                                     sub_ext)
+            if not TvMover.paths_are_equal(sub_path, new_sub_path):
+                changes.append((sub_path, new_sub_path))
+
+        return changes
@@ -0,0 +1,57 @@
+import configparser as cfg
+
+from mediamanager.subcomponents import Constants
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Config:
+    """The libraries in media.cfg, read the first time one is asked for
+
+    a library is a section named after its kind, alone or followed by a
+    dot and a name, eg. [tv], [tv.anime], [movies] or [movies.4k]. only
+    the libraries that are used need to be there
+    """
+
+    KINDS = ('tv', 'movies')
+    PATHS = ('src_path', 'stg_path', 'tgt_path')
+
+    def __init__(self, path: str = Constants.CFG_FILE):
+        self.path = path
+        self._parser = None
+
+    @property
+    def parser(self) -> cfg.ConfigParser:
+        if self._parser is None:
+            parser = cfg.ConfigParser()
+            if len(parser.read(self.path)) == 0:
+                raise ConfigError(f'{self.path} not found')
+            self._parser = parser
+        return self._parser
+
+    def libraries(self, kind: str) -> list:
+        """returns the names of the libraries of a kind, eg. tv and
+        tv.anime"""
+        if kind not in Config.KINDS:
+            raise ValueError(f'unknown library kind: {kind}')
+
+        names = [name for name in self.parser.sections()
+                 if name == kind or name.startswith(kind + '.')]
+        if len(names) == 0:
+            raise ConfigError(f'no [{kind}] library in {self.path}')
+
+        return names
+
+    def library(self, name: str):
+        """returns the section of a library, checking it has its paths"""
+        if not self.parser.has_section(name):
+            raise ConfigError(f'no [{name}] library in {self.path}')
+
+        section = self.parser[name]
+        for key in Config.PATHS:
+            if key not in section:
+                raise ConfigError(f'[{name}] in {self.path} has no {key}')
+
+        return section
@@ -0,0 +1,112 @@
+import os
+import hashlib
+
+from mediamanager.subcomponents import Constants
+from mediamanager.index import ScanIndex
+
+
+class FingerprintIndex:
+    """Content fingerprints of library files, stored alongside the scan
+    index so each file is only read again when its size or mtime change
+
+    a fingerprint is the size plus a hash of chunks from the head, middle
+    and tail of a file, which is enough to tell media files apart without
+    reading them whole
+    """
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS fingerprints ('
+              '    path TEXT PRIMARY KEY,'
+              '    size INTEGER,'
+              '    mtime INTEGER,'
+              '    fingerprint TEXT);')
+
+    def __init__(self, index: ScanIndex,
+                 chunk_size: int = Constants.Duplicates.CHUNK_SIZE):
+        self.index = index
+        self.chunk_size = chunk_size
+        self._ready = False
+
+    @property
+    def conn(self):
+        conn = self.index.conn
+        if not self._ready:
+            conn.executescript(FingerprintIndex.SCHEMA)
+            self._ready = True
+        return conn
+
+    @staticmethod
+    def sample_ranges(size: int, chunk_size: int) -> list:
+        """the (start, end) byte ranges a fingerprint is made of"""
+        if size <= chunk_size * 3:
+            return [(0, size)]
+
+        return [(offset, offset + chunk_size)
+                for offset in (0, (size - chunk_size) // 2,
+                               size - chunk_size)]
+
+    @staticmethod
+    def new_digest(size: int):
+        return hashlib.blake2b(str(size).encode(), digest_size=20)
+
+    def compute(self, path: str, size: int) -> str:
+        digest = FingerprintIndex.new_digest(size)
+
+        with open(path, 'rb') as file:
+            for start, end in FingerprintIndex.sample_ranges(
+                    size, self.chunk_size):
+                file.seek(start)
+                digest.update(file.read(end - start))
+
+        return digest.hexdigest()
+
+    def fingerprint(self, path: str) -> str:
+        stat = os.stat(path)
+
+        with self.index.lock:
+            row = self.conn.execute('SELECT size, mtime, fingerprint '
+                                    'FROM fingerprints WHERE path = ?',
+                                    (path,)).fetchone()
+
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+
+        fingerprint = self.compute(path, stat.st_size)
+        self.remember(path, fingerprint)
+
+        return fingerprint
+
+    def remember(self, path: str, fingerprint: str):
+        """stores a fingerprint computed elsewhere, eg. while copying"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        with self.index.lock:
+            self.conn.execute('INSERT OR REPLACE INTO fingerprints '
+                              'VALUES (?, ?, ?, ?)',
+                              (path, stat.st_size, stat.st_mtime_ns,
+                               fingerprint))
+            self.conn.commit()
+
+    def find_duplicate(self, path: str, size: int, library: str):
+        """returns a file in the indexed library with the same content as
+        path, or None. only files of the same size are ever read"""
+        candidates = [c for c in self.index.files_of_size(size, library)
+                      if c != path]
+        if len(candidates) == 0:
+            return None
+
+        try:
+            fingerprint = self.fingerprint(path)
+        except OSError:
+            return None
+
+        for candidate in candidates:
+            try:
+                if self.fingerprint(candidate) == fingerprint:
+                    return candidate
+            except OSError:
+                continue
+
+        return None
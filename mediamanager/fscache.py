@@ -0,0 +1,131 @@
+import os
+import threading as thr
+
+
+class MetadataCache:
+    """Remembers, for the length of a run, which directories exist and
+    what's in them, so planning doesn't go back to the filesystem (a round
+    trip on a network share) for every file
+
+    a directory is listed once, the first time anything in it is looked
+    up. files and directories created through the cache are added to it,
+    anything else that changes during the run isn't seen
+    """
+
+    def __init__(self):
+        # directory -> {name: is a directory}, or None if it doesn't exist
+        self._listings = dict()
+        self._lock = thr.RLock()
+
+        self.syscalls = 0
+        self.saved = 0
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return os.path.normpath(path.replace('\\', '/'))
+
+    def listing(self, directory: str):
+        directory = MetadataCache.normalize(directory)
+
+        with self._lock:
+            if directory in self._listings:
+                return self._listings[directory]
+
+            self.syscalls += 1
+            try:
+                with os.scandir(directory) as entries:
+                    listing = {entry.name: entry.is_dir() for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                listing = None
+
+            self._listings[directory] = listing
+            return listing
+
+    def _lookup(self, path: str):
+        directory, name = os.path.split(MetadataCache.normalize(path))
+
+        with self._lock:
+            cached = directory in self._listings
+            listing = self.listing(directory)
+            if cached:
+                self.saved += 1
+
+        return None if listing is None else listing.get(name)
+
+    def exists(self, path: str) -> bool:
+        return self._lookup(path) is not None
+
+    def isfile(self, path: str) -> bool:
+        return self._lookup(path) is False
+
+    def isdir(self, path: str) -> bool:
+        return self._lookup(path) is True
+
+    def makedirs(self, path: str):
+        """creates a directory and its parents, unless they're known to
+        exist already"""
+        path = MetadataCache.normalize(path)
+
+        with self._lock:
+            if self.isdir(path):
+                return
+
+            self.syscalls += 1
+            os.makedirs(path, exist_ok=True)
+
+            # the new directories are empty, and exist in their parents
+            self._listings[path] = dict()
+            while True:
+                parent, name = os.path.split(path)
+                if parent == path or parent not in self._listings:
+                    break
+
+                if self._listings[parent] is not None:
+                    self._listings[parent][name] = True
+                    break
+
+                self._listings[parent] = {name: True}
+                path = parent
+
+    def add_file(self, path: str):
+        """records a file created during the run"""
+        directory, name = os.path.split(MetadataCache.normalize(path))
+
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                listing[name] = False
+
+    def remove_file(self, path: str):
+        """records a file removed (or moved away) during the run"""
+        directory, name = os.path.split(MetadataCache.normalize(path))
+
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                listing.pop(name, None)
+
+    def forget(self, path: str):
+        """drops what's known about a directory that was removed"""
+        path = MetadataCache.normalize(path)
+        prefix = os.path.join(path, '')
+
+        with self._lock:
+            for directory in list(self._listings):
+                if directory == path or directory.startswith(prefix):
+                    del self._listings[directory]
+
+            parent, name = os.path.split(path)
+            listing = self._listings.get(parent)
+            if listing is not None:
+                listing.pop(name, None)
+
+    def clear(self):
+        """drops everything, eg. between the batches of a watch, since
+        other programs change the filesystem in the meantime"""
+        with self._lock:
+            self._listings.clear()
+
+    def report(self) -> str:
+        return (f'fs cache: {len(self._listings)} directories cached, '
+                f'{self.syscalls} filesystem calls, {self.saved} saved')
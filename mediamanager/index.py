@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading as thr
+
+from mediamanager.walker import ParallelWalker, list_dir
+
+
+class ScanIndex:
+    """A persistent index of directory listings, used to skip rescanning
+    directories that have not changed since the last run"""
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS dirs ('
+              '    path TEXT PRIMARY KEY,'
+              '    parent TEXT,'
+              '    mtime INTEGER);'
+
+              'CREATE TABLE IF NOT EXISTS files ('
+              '    path TEXT PRIMARY KEY,'
+              '    dir TEXT,'
+              '    name TEXT,'
+              '    size INTEGER,'
+              '    mtime INTEGER,'
+              '    inode INTEGER);'
+
+              'CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);'
+              'CREATE INDEX IF NOT EXISTS files_dir ON files (dir);'
+              'CREATE INDEX IF NOT EXISTS files_size ON files (size);')
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.rebuild = False
+
+        self.dirs_scanned = 0
+        self.dirs_skipped = 0
+        # every stat and scandir made, for the whole run
+        self.syscalls = 0
+
+        self._conn = None
+        self.lock = thr.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # the database is opened on first use, so importing the package
+        # doesn't touch the disk
+        with self.lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_path,
+                                             check_same_thread=False)
+                self._conn.executescript(ScanIndex.SCHEMA)
+            return self._conn
+
+    def walk(self, top: str):
+        """walks like os.walk, yielding (root, dirs, files) where files are
+        (name, size, mtime, inode) records
+
+        a directory is only listed again if its mtime changed since the
+        last walk, otherwise its entries are read from the index.
+        directories are visited in parallel, so the order isn't fixed
+        """
+        top = top.replace('\\', '/').rstrip('/')
+        known = dict() if self.rebuild else self.snapshot(top)
+
+        try:
+            yield from ParallelWalker(
+                lambda path: self.list_dir(path, known)).walk(top)
+        finally:
+            with self.lock:
+                self.conn.commit()
+
+    def snapshot(self, top: str) -> dict:
+        """reads the indexed listings beneath top in two queries, as
+        directory -> [mtime, dirs, files], so a walk of an unchanged tree
+        doesn't query the index once per directory"""
+        subtree = (top, top + '/', top + '0')
+
+        with self.lock:
+            dirs = self.conn.execute('SELECT path, parent, mtime FROM dirs '
+                                     'WHERE path = ? OR (path >= ? '
+                                     'AND path < ?) ORDER BY path',
+                                     subtree).fetchall()
+            files = self.conn.execute('SELECT dir, name, size, mtime, inode '
+                                      'FROM files WHERE dir = ? OR (dir >= ? '
+                                      'AND dir < ?) ORDER BY name',
+                                      subtree).fetchall()
+
+        known = dict()
+        for path, parent, mtime in dirs:
+            known.setdefault(path, [None, [], []])[0] = mtime
+            known.setdefault(parent, [None, [], []])[1].append(
+                path.split('/')[-1])
+
+        for directory, *record in files:
+            known.setdefault(directory, [None, [], []])[2].append(
+                tuple(record))
+
+        return known
+
+    def list_dir(self, path: str, known: dict = None):
+        """the lister used by walk, reading unchanged directories from the
+        index (or from a snapshot of it) and refreshing the rest from
+        disk"""
+        with self.lock:
+            self.syscalls += 1
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.forget(path)
+            raise
+
+        if known is not None and path in known:
+            indexed_mtime, dirs, files = known[path]
+            if not self.rebuild and indexed_mtime == mtime:
+                with self.lock:
+                    self.dirs_skipped += 1
+                return dirs, files
+
+        elif not self.rebuild and self.dir_mtime(path) == mtime:
+            with self.lock:
+                self.dirs_skipped += 1
+            return self.listing(path)
+
+        with self.lock:
+            self.dirs_scanned += 1
+        return self.refresh(path, mtime)
+
+    def dir_mtime(self, path: str):
+        with self.lock:
+            row = self.conn.execute('SELECT mtime FROM dirs WHERE path = ?',
+                                    (path,)).fetchone()
+        return row[0] if row else None
+
+    def listing(self, path: str):
+        with self.lock:
+            dirs = self.conn.execute('SELECT path FROM dirs WHERE parent = ? '
+                                     'ORDER BY path', (path,)).fetchall()
+            files = self.conn.execute('SELECT name, size, mtime, inode '
+                                      'FROM files WHERE dir = ? '
+                                      'ORDER BY name', (path,)).fetchall()
+
+        dirs = [d.split('/')[-1] for d, in dirs]
+
+        return dirs, files
+
+    def refresh(self, path: str, mtime: int):
+        """lists a directory from disk and replaces its entries in the index"""
+        try:
+            dirs, files = list_dir(path)
+        except OSError:
+            dirs, files = list(), list()
+
+        # a scandir, and a stat for each file that was sized
+        with self.lock:
+            self.syscalls += 1 + sum(1 for _, size, *_ in files
+                                     if size is not None)
+
+        dirs.sort()
+        files.sort()
+
+        with self.lock:
+            known_dirs, _ = self.listing(path)
+            for gone in set(known_dirs) - set(dirs):
+                self.forget(f'{path}/{gone}')
+
+            parent = path.rsplit('/', 1)[0] if '/' in path else None
+
+            self.conn.execute('DELETE FROM files WHERE dir = ?', (path,))
+            self.conn.executemany('INSERT OR REPLACE INTO files '
+                                  'VALUES (?, ?, ?, ?, ?, ?)',
+                                  ((f'{path}/{name}', path, name, *stat)
+                                   for name, *stat in files))
+            self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                              (path, parent, mtime))
+
+            # subdirectories are added without an mtime,
+            # so they are always listed on their first visit
+            self.conn.executemany('INSERT OR IGNORE INTO dirs '
+                                  'VALUES (?, ?, NULL)',
+                                  ((f'{path}/{d}', path) for d in dirs))
+
+        return dirs, files
+
+    def forget(self, path: str):
+        """removes a directory and everything beneath it from the index"""
+        # "/" sorts directly before "0", so this range matches the subtree
+        # without LIKE, which would treat "_" in file names as a wildcard
+        subtree = (path, path + '/', path + '0')
+
+        with self.lock:
+            self.conn.execute('DELETE FROM dirs WHERE path = ? '
+                              'OR (path >= ? AND path < ?)', subtree)
+            self.conn.execute('DELETE FROM files WHERE dir = ? '
+                              'OR (dir >= ? AND dir < ?)', subtree)
+
+    def file_stat(self, path: str):
+        """returns the indexed (size, mtime, inode) of a file, if known.
+        files that aren't media are indexed without them"""
+        with self.lock:
+            row = self.conn.execute('SELECT size, mtime, inode FROM files '
+                                    'WHERE path = ? AND size IS NOT NULL',
+                                    (path,)).fetchone()
+        return row
+
+    def files_of_size(self, size: int, top: str) -> list:
+        """returns the indexed files beneath top with the given size"""
+        top = top.replace('\\', '/').rstrip('/')
+
+        with self.lock:
+            rows = self.conn.execute('SELECT path FROM files WHERE size = ? '
+                                     'AND (dir = ? OR (dir >= ? AND dir < ?))',
+                                     (size, top, top + '/', top + '0')
+                                     ).fetchall()
+
+        return [path for path, in rows]
+
+    def size_of(self, path: str) -> int:
+        """returns the size of a file, from the index where possible"""
+        row = self.file_stat(path)
+        if row is not None:
+            return row[0]
+
+        with self.lock:
+            self.syscalls += 1
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def stat_of(self, path: str) -> tuple:
+        """returns the (size, mtime) of a file, from the index where
+        possible"""
+        row = self.file_stat(path)
+        if row is not None:
+            return row[0], row[1]
+
+        with self.lock:
+            self.syscalls += 1
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0, 0
+
+        return stat.st_size, stat.st_mtime_ns
+
+    def stats(self) -> str:
+        return (f'index: {self.dirs_scanned} directories scanned, '
+                f'{self.dirs_skipped} skipped')
+
+    def reset_stats(self):
+        self.dirs_scanned = 0
+        self.dirs_skipped = 0
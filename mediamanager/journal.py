@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+import threading as thr
+
+from mediamanager.subcomponents import Output, Constants
+from mediamanager.transfer import CopyEngine
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferJournal:
+    """A write-ahead journal of planned, in-progress and completed
+    transfers, so that an interrupted run resumes partial copies from
+    their last checkpoint and skips the files that were already staged
+
+    transfers move through planned -> copying -> staged, and are removed
+    from the journal once promoted to the target
+    """
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS transfers ('
+              '    dst TEXT PRIMARY KEY,'
+              '    src TEXT,'
+              '    size INTEGER,'
+              '    mtime INTEGER,'
+              '    status TEXT,'
+              '    copied INTEGER,'
+              '    updated REAL);')
+
+    def __init__(self, db_path: str,
+                 checkpoint_bytes: int = Constants.Journal.CHECKPOINT_BYTES):
+        self.db_path = db_path
+        self.checkpoint_bytes = checkpoint_bytes
+
+        self.cancelled = thr.Event()
+
+        self._conn = None
+        self._lock = thr.RLock()
+        self._checkpoints = dict()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_path,
+                                             check_same_thread=False)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.executescript(TransferJournal.SCHEMA)
+            return self._conn
+
+    def _set(self, dst: str, **fields):
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{column} = ?' for column in fields)
+
+        with self._lock:
+            self.conn.execute(f'UPDATE transfers SET {columns} WHERE dst = ?',
+                              (*fields.values(), dst))
+            self.conn.commit()
+
+    def lookup(self, dst: str):
+        """returns the (src, size, mtime, status, copied) of a transfer"""
+        with self._lock:
+            return self.conn.execute('SELECT src, size, mtime, status, copied '
+                                     'FROM transfers WHERE dst = ?',
+                                     (dst,)).fetchone()
+
+    def plan(self, jobs):
+        """records (src, dst[, size]) jobs, keeping the progress of any
+        transfer whose source hasn't changed since it was journaled"""
+        with self._lock:
+            for job in jobs:
+                src, dst = job[0], job[1]
+
+                try:
+                    stat = os.stat(src)
+                except OSError:
+                    continue
+
+                row = self.lookup(dst)
+                if row is not None and row[:3] == (src, stat.st_size,
+                                                   stat.st_mtime_ns):
+                    continue
+
+                self.conn.execute('INSERT OR REPLACE INTO transfers '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (dst, src, stat.st_size, stat.st_mtime_ns,
+                                   'planned', 0, time.time()))
+            self.conn.commit()
+
+    def resume_offset(self, src: str, dst: str) -> int:
+        """how far a partial copy of src at dst can be trusted"""
+        row = self.lookup(dst)
+        if row is None or row[3] != 'copying':
+            return 0
+
+        try:
+            src_stat = os.stat(src)
+            dst_size = os.stat(dst).st_size
+        except OSError:
+            return 0
+
+        if row[:3] != (src, src_stat.st_size, src_stat.st_mtime_ns):
+            return 0
+
+        return min(row[4], dst_size)
+
+    def is_staged(self, src: str, dst: str) -> bool:
+        row = self.lookup(dst)
+        if row is None or row[3] != 'staged':
+            return False
+
+        try:
+            return os.stat(dst).st_size == row[1] == os.stat(src).st_size
+        except OSError:
+            return False
+
+    def is_cancelled(self, cancelled=None) -> bool:
+        return self.cancelled.is_set() \
+            or (cancelled is not None and cancelled.is_set())
+
+    def checkpoint(self, dst: str, fd: int, offset: int, cancelled=None):
+        """called by the copy engine after every chunk it writes"""
+        last = self._checkpoints.get(dst, 0)
+        cancelled = self.is_cancelled(cancelled)
+
+        if offset - last < self.checkpoint_bytes and not cancelled:
+            return
+
+        # the data has to be on disk before the journal can point past it
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+
+        self._checkpoints[dst] = offset
+        self._set(dst, copied=offset)
+
+        if cancelled:
+            raise TransferCancelled(dst)
+
+    def transfer(self, move, src: str, dst: str, cancelled=None) -> str:
+        """runs move(src, dst) under the journal; only the file that failed
+        is removed, and cancelled copies are kept to be resumed
+
+        cancelled is an optional threading.Event that stops this transfer
+        alone, eg. that of one import of the asyncio API. a copy stopped by
+        it is removed instead of kept, since nothing will resume it
+        """
+        file_name = dst.replace('\\', '/').split('/')[-1]
+
+        if self.is_cancelled(cancelled):
+            raise TransferCancelled(dst)
+
+        if self.is_staged(src, dst):
+            Output.log.message(f'[SKIP] {file_name} (already staged)')
+            return dst
+
+        if self.lookup(dst) is None:
+            self.plan([(src, dst)])
+
+        offset = 0
+        if isinstance(move, CopyEngine):
+            offset = self.resume_offset(src, dst)
+            if offset > 0:
+                Output.log.message(f'[RESUME] {file_name} '
+                                   f'from {offset / 1024 ** 2:,.1f} MB')
+
+        self._set(dst, status='copying', copied=offset)
+        self._checkpoints[dst] = offset
+
+        try:
+            if isinstance(move, CopyEngine):
+                progress = (lambda fd, position:
+                            self.checkpoint(dst, fd, position, cancelled))
+                move.copy(src, dst, offset=offset, progress=progress)
+            else:
+                move(src, dst)
+        except TransferCancelled:
+            Output.log.message(f'[CANCELLED] {file_name}', level='warning')
+            if not self.cancelled.is_set():
+                self.discard(dst)
+            raise
+        except Exception:
+            self._set(dst, status='failed', copied=0)
+            self.remove(dst)
+            raise
+        finally:
+            self._checkpoints.pop(dst, None)
+
+        self._set(dst, status='staged', copied=0)
+        return dst
+
+    @staticmethod
+    def remove(dst: str):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+
+    def discard(self, dst: str):
+        """forgets a transfer, removing what was copied of it"""
+        self.remove(dst)
+        # its row is dropped, as that of a promoted file is
+        self.promoted(dst)
+
+    def promoted(self, dst: str):
+        self.forget(dst)
+
+    def forget(self, *dsts):
+        """drops the rows of transfers in one transaction, eg. of files
+        that turned out to be on the target already"""
+        with self._lock:
+            self.conn.executemany('DELETE FROM transfers WHERE dst = ?',
+                                  ((dst,) for dst in dsts))
+            self.conn.commit()
+
+    def cancel(self):
+        """stops every running copy at its next chunk, keeping its progress"""
+        self.cancelled.set()
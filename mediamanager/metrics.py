@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import atexit
+import functools
+import contextlib
+import threading as thr
+
+
+class Metrics:
+    """Wall time, files, bytes and filesystem calls per phase of a run
+    (scan, plan, stage, promote, clear_stage), and how long each worker
+    was busy or idle in it
+
+    at the end of the run they're written to a Prometheus textfile, for
+    node_exporter's textfile collector, and a JSON summary
+
+    disabled until enable() is called. while disabled, phase() and busy()
+    hand back a shared context that does nothing, and the counters return
+    straight away, so the instrumentation costs next to nothing
+
+    phases can overlap (promotion runs while files are still staging) and
+    nest (planning a show scans it), so their times don't add up to the
+    length of the run. a phase entered on several threads at once, eg.
+    the stage of shows deployed concurrently, counts that time once
+    """
+
+    NAMESPACE = 'mediamanager'
+
+    _DISABLED = contextlib.nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.library = None
+        self.started = None
+
+        # phase -> {seconds, calls, files, bytes, syscalls}
+        self.phases = dict()
+        # phase -> {worker: busy seconds}
+        self.workers = dict()
+        # phase -> [blocks running, when the first started, syscalls then]
+        self._running = dict()
+
+        self._syscall_sources = list()
+        self._lock = thr.Lock()
+
+    def enable(self, directory: str, library: str):
+        """starts recording, and writes the metrics to directory when
+        the run exits"""
+        self.enabled = True
+        self.directory = directory
+        self.library = library
+        self.started = time.time()
+
+        atexit.register(self.export)
+
+    def count_syscalls(self, source):
+        """adds a callable returning a running count of filesystem calls,
+        eg. those made by the scan index or the metadata cache"""
+        self._syscall_sources.append(source)
+
+    def syscalls(self) -> int:
+        return sum(source() for source in self._syscall_sources)
+
+    def _phase(self, name: str) -> dict:
+        # callers hold the lock
+        if name not in self.phases:
+            self.phases[name] = {'seconds': 0.0, 'calls': 0, 'files': 0,
+                                 'bytes': 0, 'syscalls': 0}
+        return self.phases[name]
+
+    def phase(self, name: str):
+        """times a block as part of a phase"""
+        if not self.enabled:
+            return Metrics._DISABLED
+        return self._timed_phase(name)
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name: str):
+        with self._lock:
+            running = self._running.setdefault(name, [0, 0.0, 0])
+            if running[0] == 0:
+                running[1:] = time.perf_counter(), self.syscalls()
+            running[0] += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                phase = self._phase(name)
+                phase['calls'] += 1
+
+                # the time is added once the last block running leaves
+                running[0] -= 1
+                if running[0] == 0:
+                    phase['seconds'] += time.perf_counter() - running[1]
+                    phase['syscalls'] += self.syscalls() - running[2]
+
+    def timed(self, name: str):
+        """decorates a function so every call is timed as part of a
+        phase"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+
+                with self._timed_phase(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def busy(self, name: str):
+        """times a block as the calling worker being busy in a phase"""
+        if not self.enabled:
+            return Metrics._DISABLED
+        return self._busy(name)
+
+    @contextlib.contextmanager
+    def _busy(self, name: str):
+        worker = Metrics.worker_name()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                workers = self.workers.setdefault(name, dict())
+                workers[worker] = workers.get(worker, 0.0) + elapsed
+
+    @staticmethod
+    def worker_name() -> str:
+        # transfers run on one shared pool, whose threads keep their names
+        # (eg. transfer_3) for the whole run, so every batch adds up under
+        # the same labels. threads of unnamed pools, which may be started
+        # per call, are named by their slot, eg. ThreadPoolExecutor-3_1 ->
+        # 1, so they can't add a label per pool
+        name = thr.current_thread().name
+        if name.startswith('ThreadPoolExecutor'):
+            return name.rsplit('_', 1)[-1]
+        return name
+
+    def add(self, name: str, files: int = 1, size: int = 0):
+        """counts files and bytes handled in a phase"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            phase = self._phase(name)
+            phase['files'] += files
+            phase['bytes'] += size
+
+    def add_file(self, name: str, path: str):
+        """counts a file handled in a phase, by its size on disk"""
+        if not self.enabled:
+            return
+
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            size = 0
+
+        self.add(name, 1, size)
+
+    def summary(self) -> dict:
+        with self._lock:
+            phases = dict()
+            for name, phase in self.phases.items():
+                seconds = phase['seconds']
+                workers = {worker: {'busy': round(busy, 4),
+                                    'idle': round(max(0.0, seconds - busy),
+                                                  4)}
+                           for worker, busy
+                           in self.workers.get(name, dict()).items()}
+
+                phases[name] = {**phase, 'seconds': round(seconds, 4),
+                                'files_per_second': round(
+                                    phase['files'] / seconds, 3)
+                                if seconds > 0 else 0.0,
+                                'mb_per_second': round(
+                                    phase['bytes'] / seconds / 1024 ** 2, 3)
+                                if seconds > 0 else 0.0,
+                                'workers': workers}
+
+        return {'library': self.library, 'started': self.started,
+                'seconds': round(time.time() - self.started, 4),
+                'phases': phases}
+
+    def prometheus(self, summary: dict) -> str:
+        """renders a summary in the Prometheus text format"""
+        library = summary['library']
+        lines = list()
+
+        def metric(name, kind, help_text, samples):
+            name = f'{Metrics.NAMESPACE}_{name}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                labels = ','.join(f'{key}="{value}"'
+                                  for key, value in {'library': library,
+                                                     **labels}.items())
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        phases = summary['phases']
+
+        metric('last_run_timestamp_seconds', 'gauge',
+               'when the last run started', [({}, summary['started'])])
+        metric('run_seconds', 'gauge', 'wall time of the last run',
+               [({}, summary['seconds'])])
+
+        for key, help_text in (('seconds', 'wall time spent in a phase'),
+                               ('calls', 'times a phase was entered'),
+                               ('files', 'files handled in a phase'),
+                               ('bytes', 'bytes handled in a phase'),
+                               ('syscalls', 'filesystem calls made by the '
+                                            'scan index and metadata cache '
+                                            'during a phase')):
+            metric(f'phase_{key}', 'gauge', help_text,
+                   [({'phase': name}, phase[key])
+                    for name, phase in phases.items()])
+
+        for key in ('busy', 'idle'):
+            metric(f'worker_{key}_seconds', 'gauge',
+                   f'time a worker was {key} during a phase',
+                   [({'phase': name, 'worker': worker}, times[key])
+                    for name, phase in phases.items()
+                    for worker, times in phase['workers'].items()])
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """writes the Prometheus textfile and the JSON summary, replacing
+        those of an earlier export"""
+        if not self.enabled:
+            return
+
+        summary = self.summary()
+        os.makedirs(self.directory, exist_ok=True)
+
+        name = f'{Metrics.NAMESPACE}_{self.library}'
+        for extension, text in (
+                ('prom', self.prometheus(summary)),
+                ('json', json.dumps(summary, indent=2) + '\n')):
+            path = os.path.join(self.directory, f'{name}.{extension}')
+
+            # node_exporter may read the file at any time, so it's
+            # replaced in one step instead of written in place
+            with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                file.write(text)
+            os.replace(path + '.tmp', path)
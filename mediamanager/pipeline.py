@@ -0,0 +1,136 @@
+import queue
+import threading as thr
+
+from mediamanager.subcomponents import Output, Constants
+
+
+class Pipeline:
+    """Runs a chain of stages on their own threads, connected by bounded
+    queues, so that later stages start on the first items while earlier
+    stages are still producing
+
+    each stage is a function taking one item and returning an iterable of
+    zero or more items for the next stage
+    """
+
+    _DONE = object()
+
+    def __init__(self, source,
+                 queue_size: int = Constants.Pipeline.QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+
+        self.stages = list()
+        self.queues = dict()
+        self.high_water = dict()
+
+        self._lock = thr.Lock()
+
+    def stage(self, name: str, fn, workers: int = 1) -> 'Pipeline':
+        self.stages.append((name, fn, max(1, workers)))
+        return self
+
+    def depths(self) -> dict:
+        """the number of items waiting in front of each stage"""
+        return {name: q.qsize() for name, q in self.queues.items()}
+
+    def report(self) -> str:
+        depths = ', '.join(f'{name} {depth}/{self.queue_size}'
+                           for name, depth in self.high_water.items())
+        return f'pipeline: max queue depth {depths}'
+
+    def _put(self, name: str, q: queue.Queue, item):
+        q.put(item)
+
+        depth = q.qsize()
+        if depth > self.high_water[name]:
+            self.high_water[name] = depth
+
+    def run(self):
+        """starts every stage, yielding the items of the last stage"""
+        for batch in self.batches():
+            yield from batch
+
+    def batches(self):
+        """starts every stage, yielding the items of the last stage in
+        lists of whatever is waiting, so a consumer can work on several
+        at once while the stages keep producing"""
+        names = [name for name, _, _ in self.stages] + ['output']
+        for name in names:
+            self.queues[name] = queue.Queue(self.queue_size)
+            self.high_water[name] = 0
+
+        threads = [thr.Thread(target=self._produce, args=(names[0],),
+                              daemon=True)]
+
+        for idx, (name, fn, workers) in enumerate(self.stages):
+            remaining = [workers]
+            next_name = names[idx + 1]
+            next_workers = (self.stages[idx + 1][2]
+                            if idx + 1 < len(self.stages) else 1)
+
+            for _ in range(workers):
+                threads.append(thr.Thread(target=self._work,
+                                          args=(name, fn, next_name,
+                                                remaining, next_workers),
+                                          daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        output = self.queues['output']
+        done = False
+        while not done:
+            batch = [output.get()]
+            while True:
+                try:
+                    batch.append(output.get_nowait())
+                except queue.Empty:
+                    break
+
+            if Pipeline._DONE in batch:
+                batch = batch[:batch.index(Pipeline._DONE)]
+                done = True
+
+            if batch:
+                yield batch
+
+        for thread in threads:
+            thread.join()
+
+    def _produce(self, first: str):
+        first_workers = self.stages[0][2] if self.stages else 1
+
+        try:
+            for item in self.source:
+                self._put(first, self.queues[first], item)
+        except Exception as e:
+            Output.log.message(e, level='error')
+        finally:
+            for _ in range(first_workers):
+                self.queues[first].put(Pipeline._DONE)
+
+    def _work(self, name: str, fn, next_name: str, remaining: list,
+              next_workers: int):
+        inbox = self.queues[name]
+        outbox = self.queues[next_name]
+
+        while True:
+            item = inbox.get()
+            if item is Pipeline._DONE:
+                break
+
+            try:
+                for result in fn(item):
+                    self._put(next_name, outbox, result)
+            except Exception as e:
+                Output.log.message(f'[{name}] {e}', level='error')
+
+        # the last worker of a stage to finish tells the next stage
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+
+        if last:
+            for _ in range(next_workers):
+                outbox.put(Pipeline._DONE)
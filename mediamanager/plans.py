@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import itertools
+
+
+class PlanError(Exception):
+    pass
+
+
+class Plan:
+    """A deployment plan saved to a file, so it can be reviewed before
+    it's applied, and applied without rescanning or renaming anything
+
+    a plan is JSON lines: a header with the library and its paths, then
+    one entry per file. entries are written and read one line at a time,
+    so a large plan never has to fit in memory
+
+    an entry is a dict of
+        src: the file to move
+        dst: where it goes on the stage (or the target, for links)
+        size, mtime: the stat of src when the plan was made
+        op: copy, rename, hardlink, link (to an existing target file),
+            or skip
+        conflict: why the file is skipped or needs a second look
+        group: the tv show of an episode, or movies
+        replaces: a target file to remove once dst is promoted
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def entry(src: str, dst: str, size: int, mtime: int, op: str,
+              conflict: str = None, **extra) -> dict:
+        entry = {'src': src, 'dst': dst, 'size': size, 'mtime': mtime,
+                 'op': op}
+        if conflict is not None:
+            entry['conflict'] = conflict
+        entry.update((k, v) for k, v in extra.items() if v is not None)
+        return entry
+
+    def write(self, kind: str, paths: dict, entries) -> dict:
+        """writes the header and entries, returning counts per op"""
+        counts = dict()
+        header = {'version': Plan.VERSION, 'kind': kind,
+                  'created': time.time(), **paths}
+
+        with open(self.path, 'w', encoding='utf-8') as plan_file:
+            plan_file.write(json.dumps(header) + '\n')
+            for entry in entries:
+                plan_file.write(json.dumps(entry, separators=(',', ':'))
+                                + '\n')
+                counts[entry['op']] = counts.get(entry['op'], 0) + 1
+
+        return counts
+
+    def header(self) -> dict:
+        with open(self.path, encoding='utf-8') as plan_file:
+            return json.loads(plan_file.readline())
+
+    def entries(self):
+        with open(self.path, encoding='utf-8') as plan_file:
+            plan_file.readline()
+            for line in plan_file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def groups(self):
+        """yields (group, entries) for each run of entries in a group"""
+        for group, entries in itertools.groupby(
+                self.entries(), key=lambda e: e.get('group')):
+            yield group, list(entries)
+
+    def stale(self) -> list:
+        """returns the entries whose source changed since planning"""
+        stale = list()
+        for entry in self.entries():
+            if entry['op'] == 'skip':
+                continue
+
+            try:
+                stat = os.stat(entry['src'])
+            except OSError:
+                stale.append(entry)
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (entry['size'],
+                                                    entry['mtime']):
+                stale.append(entry)
+
+        return stale
+
+    def check(self, kind: str, paths: dict) -> dict:
+        """returns the header of a plan that's safe to apply,
+        or raises PlanError"""
+        header = self.header()
+
+        if header.get('version') != Plan.VERSION:
+            raise PlanError(f'{self.path}: unsupported plan version '
+                            f'{header.get("version")}')
+
+        if header.get('kind') != kind:
+            raise PlanError(f'{self.path}: this is a {header.get("kind")} '
+                            f'plan, not a {kind} plan')
+
+        for key, path in paths.items():
+            if header.get(key) != path:
+                raise PlanError(f'{self.path}: {key} was {header.get(key)} '
+                                f'when planned, now {path}')
+
+        stale = self.stale()
+        if len(stale) > 0:
+            raise PlanError(f'{self.path}: {len(stale)} source files '
+                            f'changed since planning, '
+                            f'eg. {stale[0]["src"]}')
+
+        return header
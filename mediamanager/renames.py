@@ -0,0 +1,203 @@
+import os
+import itertools
+import threading as thr
+import concurrent.futures
+
+from mediamanager.subcomponents import Output, Constants
+
+
+class RenameGraph:
+    """Orders a set of renames so that none of them overwrites a file
+
+    a rename whose destination is the source of another rename waits for
+    that one, so a chain runs from its free end. a cycle (eg. a swap) is
+    broken by moving one of its files to a temporary name first. renames
+    that collide, with each other or with a file that stays where it is,
+    are left out as conflicts, as are those of a file renamed to several
+    places
+
+    every step is a rename, so no data is ever copied. chains with
+    destinations in different directories run in parallel
+    """
+
+    TEMPORARY_SUFFIX = '.renaming'
+
+    def __init__(self, renames,
+                 workers: int = Constants.Tv.RENAME_WORKERS):
+        self.workers = workers
+
+        # (old path, new path) of the renames that go ahead, and the
+        # (old path, new path, reason) of those that were left out
+        self.renames = list()
+        self.conflicts = list()
+        # lists of (old path, new path) steps, in the order they must run
+        self.chains = list()
+        self.cycles = 0
+
+        self.renamed = 0
+        self.failed = list()
+
+        self._lock = thr.Lock()
+        self._temporary = itertools.count()
+
+        self._build(renames)
+
+    @staticmethod
+    def key(path: str) -> str:
+        # the target may be a share that doesn't tell "S01E01.mkv" from
+        # "s01e01.mkv", so paths are compared case-insensitively
+        return os.path.normpath(path).casefold()
+
+    def _build(self, renames):
+        renames = [(old_path, new_path) for old_path, new_path
+                   in dict.fromkeys(renames) if old_path != new_path]
+
+        # a file can only go to one place, so a source renamed to several
+        # stays where it is
+        by_source = dict()
+        for old_path, new_path in renames:
+            by_source.setdefault(RenameGraph.key(old_path), dict()) \
+                .setdefault(RenameGraph.key(new_path), (old_path, new_path))
+
+        left_out = set()
+        by_destination = dict()
+        for source, claims in by_source.items():
+            if len(claims) > 1:
+                for old_path, new_path in claims.values():
+                    self.conflicts.append((old_path, new_path,
+                                           f'its source is renamed to '
+                                           f'{len(claims)} places'))
+                left_out.add(source)
+                continue
+
+            old_path, new_path = next(iter(claims.values()))
+            by_destination.setdefault(RenameGraph.key(new_path),
+                                      []).append((old_path, new_path))
+
+        pending = dict()
+        for claims in by_destination.values():
+            if len(claims) > 1:
+                for old_path, new_path in claims:
+                    self.conflicts.append((old_path, new_path,
+                                           f'{len(claims)} files renamed '
+                                           f'to it'))
+                    left_out.add(RenameGraph.key(old_path))
+            else:
+                old_path, new_path = claims[0]
+                pending[RenameGraph.key(old_path)] = (old_path, new_path)
+
+        # a rename may only take a destination that's free, or that's
+        # being vacated by a rename that goes ahead. leaving one rename
+        # out can block others, so repeat until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for source, (old_path, new_path) in list(pending.items()):
+                destination = RenameGraph.key(new_path)
+                if destination == source or destination in pending:
+                    continue
+
+                if os.path.lexists(new_path):
+                    reason = ('blocked by a conflict'
+                              if destination in left_out
+                              else 'already exists')
+                    self.conflicts.append((old_path, new_path, reason))
+                    left_out.add(source)
+                    del pending[source]
+                    changed = True
+
+        self.renames = list(pending.values())
+        self._order(pending)
+
+    def _order(self, pending: dict):
+        # who moves into each path, to walk chains back from their free end
+        incoming = {RenameGraph.key(new_path): source
+                    for source, (_, new_path) in pending.items()}
+
+        def walk_back(source, chain, stop=None):
+            while source in incoming and incoming[source] != stop:
+                source = incoming[source]
+                if source not in pending:
+                    break
+                chain.append(pending.pop(source))
+            return chain
+
+        # chains end in a destination nobody is moving away from
+        for source in list(pending):
+            if source not in pending:
+                continue
+
+            old_path, new_path = pending[source]
+            destination = RenameGraph.key(new_path)
+            if destination in pending and destination != source:
+                continue
+
+            del pending[source]
+            self.chains.append(walk_back(source, [(old_path, new_path)]))
+
+        # whatever is left is in a cycle
+        while len(pending) > 0:
+            source, (old_path, new_path) = next(iter(pending.items()))
+            del pending[source]
+
+            temporary = (f'{old_path}.{next(self._temporary)}'
+                         f'{RenameGraph.TEMPORARY_SUFFIX}')
+            chain = walk_back(source, [(old_path, temporary)], stop=source)
+            chain.append((temporary, new_path))
+
+            self.chains.append(chain)
+            self.cycles += 1
+
+    def run(self):
+        """runs every chain, one directory at a time but directories in
+        parallel. a chain stops at its first failure, since its next step
+        would take the place of the file that failed to move"""
+        by_directory = dict()
+        for chain in self.chains:
+            directory = os.path.dirname(chain[0][1])
+            by_directory.setdefault(directory, []).append(chain)
+
+        def run_chains(chains):
+            for chain in chains:
+                self._run_chain(chain)
+
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            for future in [executor.submit(run_chains, chains)
+                           for chains in by_directory.values()]:
+                future.result()
+
+    def _run_chain(self, chain: list):
+        for old_path, new_path in chain:
+            try:
+                RenameGraph.rename(old_path, new_path)
+            except OSError as e:
+                with self._lock:
+                    self.failed.append((old_path, new_path, str(e)))
+                Output.log.message(f'[FAILED] {old_path}', f'|- {e}',
+                                   level='error')
+                return
+
+            if not new_path.endswith(RenameGraph.TEMPORARY_SUFFIX):
+                with self._lock:
+                    self.renamed += 1
+                Output.log.message(f'[RENAME] {new_path.split("/")[-1]}',
+                                   f'|- src: {old_path}',
+                                   f'|- tgt: {new_path}')
+
+    @staticmethod
+    def rename(old_path: str, new_path: str):
+        # os.rename replaces an existing file without asking on posix
+        if os.path.lexists(new_path) \
+                and not os.path.samefile(old_path, new_path):
+            raise FileExistsError(f'{new_path} already exists')
+
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(old_path, new_path)
+
+    def report(self) -> str:
+        ordered = sum(1 for chain in self.chains
+                      if len(chain) > 1) - self.cycles
+        return (f'renames: {self.renamed} done, {len(self.failed)} failed, '
+                f'{len(self.conflicts)} conflicts, {ordered} chains '
+                f'ordered, {self.cycles} cycles broken with a temporary '
+                f'name')
@@ -0,0 +1,362 @@
+import os
+import time
+import queue
+import collections
+import threading as thr
+import concurrent.futures
+
+from mediamanager.subcomponents import Output, Constants
+
+
+class IoScheduler:
+    """Runs file transfers on a thread pool, limiting how many transfers
+    read from or write to each device at the same time
+
+    with autotune enabled, the limit is raised one step at a time for as
+    long as the aggregate throughput keeps improving
+
+    schedulers can share one pool, eg. those of several libraries in one
+    process, so its threads are started once and reused
+    """
+
+    ORDERINGS = ('lpt', 'name', 'discovery')
+
+    MAX_WORKERS = 32
+
+    def __init__(self, per_device: int = Constants.Transfer.IO_CONCURRENCY,
+                 autotune: bool = False,
+                 max_per_device: int = Constants.Transfer.IO_MAX_CONCURRENCY,
+                 ordering: str = Constants.Transfer.ORDERING,
+                 pool: concurrent.futures.ThreadPoolExecutor = None):
+        if ordering not in IoScheduler.ORDERINGS:
+            raise ValueError(f'unknown job ordering: {ordering}')
+
+        self.per_device = max(1, per_device)
+        self.autotune = autotune
+        self.ordering = ordering
+        self.max_per_device = max(self.per_device, max_per_device)
+
+        # threads are only started as jobs are submitted
+        self.pool = pool or concurrent.futures.ThreadPoolExecutor(
+            IoScheduler.MAX_WORKERS, thread_name_prefix='transfer')
+
+        self.files = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+        self._devices = dict()
+
+        # device -> running jobs of every run, and a condition notified
+        # when they finish, so runs on several threads (eg. the shows of
+        # clean_tv.py --concurrent) share the per device limit
+        self._active = collections.Counter()
+        self._freed = thr.Condition()
+
+        # device -> running jobs of every run_async, and a condition
+        # notified when they finish, so concurrent imports share the
+        # per device limit
+        self._async_active = collections.Counter()
+        self._async_freed = None
+
+        self._window_start = None
+        self._window_bytes = 0
+        self._last_rate = None
+        self._probing = True
+
+    def device_of(self, path: str):
+        # devices are looked up per directory, not per file
+        directory = os.path.dirname(path)
+
+        if directory not in self._devices:
+            try:
+                self._devices[directory] = os.stat(directory).st_dev
+            except OSError:
+                self._devices[directory] = None
+
+        return self._devices[directory]
+
+    @staticmethod
+    def size_of(job: tuple) -> int:
+        # manifests carry the size of each file as the third item
+        if len(job) > 2:
+            return job[2]
+
+        try:
+            return os.stat(job[0]).st_size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def is_sidecar(job: tuple) -> bool:
+        extension = job[0].split('.')[-1].lower()
+        return extension in Constants.SUBTITLE_EXTENSIONS
+
+    def order_jobs(self, jobs) -> list:
+        """orders jobs by the configured policy
+
+        lpt (longest processing time first) starts the largest files first,
+        so one big file queued last can't stretch the run, then moves the
+        small sidecar files together at the end
+        """
+        jobs = list(jobs)
+
+        if self.ordering == 'name':
+            return sorted(jobs, key=lambda job: job[1])
+
+        if self.ordering == 'lpt':
+            videos = [job for job in jobs if not IoScheduler.is_sidecar(job)]
+            sidecars = [job for job in jobs if IoScheduler.is_sidecar(job)]
+
+            videos.sort(key=IoScheduler.size_of, reverse=True)
+            sidecars.sort(key=lambda job: job[1])
+
+            return videos + sidecars
+
+        return jobs
+
+    def group_jobs(self, jobs) -> dict:
+        """returns the ordered jobs grouped by their (source, target)
+        devices"""
+        groups = dict()
+        for job in self.order_jobs(jobs):
+            key = (self.device_of(job[0]), self.device_of(job[1]))
+            groups.setdefault(key, collections.deque()).append(job)
+
+        return groups
+
+    def run(self, fn, jobs, cancel=None):
+        """calls fn(src, tgt) for each (src, tgt[, size]) job, yielding
+        the futures as they complete
+
+        if interrupted, cancel() is called before waiting on the running
+        jobs, so they can stop early instead of running to completion
+        """
+        groups = self.group_jobs(jobs)
+
+        if len(groups) == 0:
+            return
+
+        active = self._active
+        completed = queue.Queue()
+        running = 0
+
+        start = time.monotonic()
+
+        try:
+            while groups or running:
+                with self._freed:
+                    # start every job whose devices have a free slot
+                    for key in list(groups):
+                        group = groups[key]
+                        key_devices = set(key)
+
+                        while group and all(
+                                active[device] < self.per_device
+                                for device in key_devices):
+                            job = group.popleft()
+                            size = IoScheduler.size_of(job)
+
+                            for device in key_devices:
+                                active[device] += 1
+
+                            future = self.pool.submit(fn, job[0], job[1])
+                            future.add_done_callback(
+                                lambda f, d=key_devices, s=size:
+                                    completed.put((f, d, s)))
+                            running += 1
+
+                        if len(group) == 0:
+                            del groups[key]
+
+                    if running == 0:
+                        # other runs hold every slot of these devices
+                        self._freed.wait()
+                        continue
+
+                future, key_devices, size = completed.get()
+                running -= 1
+                self.release(key_devices)
+
+                if (future.exception() is None
+                        and future.result() is not None):
+                    self.files += 1
+                    self.bytes += size
+
+                self.tune()
+
+                yield future
+
+        except (KeyboardInterrupt, GeneratorExit):
+            # let the running jobs stop early, then wait for them, since
+            # the pool outlives this run
+            if cancel is not None:
+                cancel()
+            for _ in range(running):
+                _, key_devices, _ = completed.get()
+                self.release(key_devices)
+            raise
+
+        self.elapsed += time.monotonic() - start
+
+    def release(self, key_devices: set):
+        """frees the slots of a job that finished"""
+        with self._freed:
+            for device in key_devices:
+                self._active[device] -= 1
+            self._freed.notify_all()
+
+    async def run_async(self, fn, jobs, cancel=None):
+        """run for an asyncio event loop, yielding (job, future) pairs
+        as the jobs complete
+
+        the runs of every import on the loop count against the same per
+        device limit, so one library's devices aren't overloaded by
+        several imports at once. if the task is cancelled, cancel() is
+        called before waiting on the running jobs
+        """
+        # asyncio takes a while to import, and only the asyncio API needs it
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+
+        # looking up devices and sizes stats files, so it's not done on
+        # the loop. the jobs yielded carry their size
+        def group_sized_jobs():
+            return self.group_jobs([(job[0], job[1], IoScheduler.size_of(job))
+                                    for job in jobs])
+
+        groups = await loop.run_in_executor(self.pool, group_sized_jobs)
+        if len(groups) == 0:
+            return
+
+        if self._async_freed is None:
+            self._async_freed = asyncio.Condition()
+
+        active = self._async_active
+        running = dict()
+
+        async def release(futures):
+            for future in futures:
+                _, key_devices, _ = running.pop(future)
+                for device in key_devices:
+                    active[device] -= 1
+
+            async with self._async_freed:
+                self._async_freed.notify_all()
+
+        start = time.monotonic()
+
+        try:
+            while groups or running:
+                for key in list(groups):
+                    group = groups[key]
+                    key_devices = set(key)
+
+                    while group and all(active[device] < self.per_device
+                                        for device in key_devices):
+                        job = group.popleft()
+
+                        for device in key_devices:
+                            active[device] += 1
+
+                        future = asyncio.wrap_future(
+                            self.pool.submit(fn, job[0], job[1]))
+                        running[future] = (job, key_devices, job[2])
+
+                    if len(group) == 0:
+                        del groups[key]
+
+                if len(running) == 0:
+                    # other imports hold every slot of these devices
+                    async with self._async_freed:
+                        await self._async_freed.wait()
+                    continue
+
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+
+                finished = [(running[future][0], future) for future in done]
+                for future in done:
+                    if (future.exception() is None
+                            and future.result() is not None):
+                        self.files += 1
+                        self.bytes += running[future][2]
+
+                await release(done)
+
+                for job, future in finished:
+                    self.tune()
+                    yield job, future
+
+        except (asyncio.CancelledError, GeneratorExit):
+            if cancel is not None:
+                cancel()
+            if len(running) > 0:
+                futures = list(running)
+                await asyncio.wait(futures)
+                for future in futures:
+                    # what they raised was expected, eg. TransferCancelled
+                    future.exception()
+                await release(futures)
+            raise
+
+        self.elapsed += time.monotonic() - start
+
+    def tune(self):
+        if not self.autotune or not self._probing:
+            return
+
+        now = time.monotonic()
+
+        if self._window_start is None:
+            self._window_start = now
+            self._window_bytes = self.bytes
+            return
+
+        window = now - self._window_start
+        if window < Constants.Transfer.AUTOTUNE_WINDOW:
+            return
+
+        rate = (self.bytes - self._window_bytes) / window
+
+        if self._last_rate is not None and rate < self._last_rate * 1.05:
+            # the last step didn't help, so step back and keep that limit
+            self.per_device = max(1, self.per_device - 1)
+            self._probing = False
+        elif self.per_device < self.max_per_device:
+            self.per_device += 1
+        else:
+            self._probing = False
+
+        Output.log.message(f'autotune: {self.per_device} per device '
+                           f'({rate / 1024 ** 2:,.1f} MB/s)')
+
+        self._last_rate = rate
+        self._window_start = now
+        self._window_bytes = self.bytes
+
+    def summary(self) -> dict:
+        rate = self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+        return {'files': self.files,
+                'bytes': self.bytes,
+                'seconds': round(self.elapsed, 3),
+                'mb_per_second': round(rate / 1024 ** 2, 3),
+                'per_device': self.per_device}
+
+    def report(self) -> str:
+        summary = self.summary()
+        return (f'scheduler: {summary["files"]} files, '
+                f'{summary["bytes"] / 1024 ** 2:,.1f} MB at '
+                f'{summary["mb_per_second"]:,.1f} MB/s, '
+                f'{summary["per_device"]} transfers per device')
+
+    @staticmethod
+    def from_config(section, pool=None) -> 'IoScheduler':
+        per_device = section.getint('io_concurrency',
+                                    Constants.Transfer.IO_CONCURRENCY)
+        autotune = section.getboolean('io_autotune', False)
+        ordering = section.get('job_ordering', Constants.Transfer.ORDERING)
+
+        return IoScheduler(per_device, autotune, ordering=ordering,
+                           pool=pool)
@@ -0,0 +1,83 @@
+from typing import Optional
+
+from mediamanager.subcomponents import Constants, NameCleaner
+
+
+class SidecarIndex:
+    """An index of subtitle files keyed by directory and normalized stem,
+    so the subtitles of a video are found in constant time
+
+    "name.srt", "name.en.srt" and an "name.idx"/"name.sub" pair are all
+    sidecars of "name.mkv"
+    """
+
+    def __init__(self):
+        self._by_dir = dict()
+        self._by_stem = dict()
+
+    @staticmethod
+    def split(file_name: str) -> Optional[tuple]:
+        """returns ([(stem, language), ...], extension) for a subtitle file,
+        or None if the file isn't a subtitle"""
+        match = NameCleaner.FILE_EXTENSION.search(file_name.lower())
+        if not match or match.group(2) not in Constants.SUBTITLE_EXTENSIONS:
+            return None
+
+        name = match.group(1)
+        stems = [(name, None)]
+
+        # "name.en.srt" belongs to "name", but "name.srt" is kept as well,
+        # since the last part of a name isn't always a language
+        if '.' in name:
+            stem, tag = name.rsplit('.', 1)
+            if tag in Constants.LANGUAGE_CODES:
+                stems.append((stem, tag))
+
+        return stems, match.group(2)
+
+    def add(self, directory: str, file_name: str) -> bool:
+        split = SidecarIndex.split(file_name)
+        if split is None:
+            return False
+
+        stems, extension = split
+        path = f'{directory}/{file_name}'
+
+        for stem, language in stems:
+            sidecar = (path, language, extension)
+            self._by_dir.setdefault((directory, stem), []).append(sidecar)
+            self._by_stem.setdefault(stem, dict()) \
+                .setdefault(directory, []).append(sidecar)
+
+        return True
+
+    def lookup(self, directory: str, stem: str,
+               any_directory: bool = False) -> list:
+        """returns the (path, language, extension) of each sidecar of the
+        video with the given stem in directory"""
+        stem = stem.lower()
+        sidecars = self._by_dir.get((directory, stem))
+
+        if sidecars is None and any_directory:
+            # only take the sidecars from one directory,
+            # so they can't overwrite each other once renamed
+            directories = self._by_stem.get(stem)
+            if directories:
+                sidecars = next(iter(directories.values()))
+
+        return sidecars or []
+
+    @staticmethod
+    def from_files(files) -> 'SidecarIndex':
+        """builds an index from (directory, file name) pairs"""
+        index = SidecarIndex()
+        for directory, file_name in files:
+            index.add(directory, file_name)
+        return index
+
+    @staticmethod
+    def sidecar_name(new_stem: str, language: Optional[str],
+                     extension: str) -> str:
+        if language:
+            return f'{new_stem}.{language}.{extension}'
+        return f'{new_stem}.{extension}'
@@ -1,15 +1,24 @@
 
 
 import re
+import sys
+import json
+import time
+import queue
+import atexit
+import contextlib
 import threading as thr
 
 from typing import Optional
-from rich.console import Console
+
+from mediamanager.metrics import Metrics
 
 
 class Constants:
     LOG_FILE = 'media.log'
     CFG_FILE = 'media.cfg'
+    INDEX_FILE = 'media.db'
+    JOURNAL_FILE = 'media.journal'
 
     PREFERRED_VIDEO_EXTENSIONS = {'mkv', 'mp4'}
 
@@ -22,6 +31,16 @@ class Constants:
 
     SUBTITLE_EXTENSIONS = {'srt', 'idx', 'sub'}
 
+    # ISO 639-1 and 639-2 codes, as used in "name.en.srt" or "name.eng.srt"
+    LANGUAGE_CODES = {'en', 'eng', 'fr', 'fre', 'fra', 'es', 'spa', 'de',
+                      'ger', 'deu', 'it', 'ita', 'pt', 'por', 'nl', 'dut',
+                      'nld', 'sv', 'swe', 'no', 'nor', 'da', 'dan', 'fi',
+                      'fin', 'pl', 'pol', 'ru', 'rus', 'ja', 'jpn', 'zh',
+                      'chi', 'zho', 'ko', 'kor', 'ar', 'ara', 'he', 'heb',
+                      'tr', 'tur', 'el', 'gre', 'ell', 'hu', 'hun', 'cs',
+                      'cze', 'ces', 'hi', 'hin', 'th', 'tha', 'vi', 'vie',
+                      'forced', 'sdh'}
+
     class Tv:
         EPISODE_REGEX = (r'(?P<episode>'  # start episode group
 
@@ -42,6 +61,65 @@ class Constants:
                          # detects multi-part episode
                          r'(?P<part_num>-(pt|part)\d)?')
 
+        # shows being planned or transferred at once with --concurrent
+        CONCURRENT_SHOWS = 2
+
+        # processes naming shows for a target cleanup, None for one per cpu
+        PLANNING_WORKERS = None
+
+        # directories renamed in at once by a target cleanup
+        RENAME_WORKERS = 4
+
+    class Transfer:
+        STRATEGY = 'auto'
+        SAME_DEVICE_OPERATION = 'link'
+
+        IO_CONCURRENCY = 2
+        IO_MAX_CONCURRENCY = 8
+        AUTOTUNE_WINDOW = 10
+
+        ORDERING = 'lpt'
+        BUFFER_SIZE = 8 * 1024 ** 2
+
+    class Scan:
+        WORKERS = 8
+        # the types in /proc/self/mounts of filesystems walked in parallel
+        NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p',
+                               'afpfs', 'ncpfs', 'ceph', 'glusterfs',
+                               'sshfs', 'rclone', 's3fs', 'davfs'}
+
+    class Duplicates:
+        POLICY = 'skip'
+        CHUNK_SIZE = 1024 ** 2
+
+    class Checksums:
+        # hashing needs the buffered copy, so it's opt-in
+        MODE = 'off'
+        DIRECTORY = 'checksums'
+
+    class Titles:
+        # probable existing movies are only reported unless a policy that
+        # drops or replaces files is picked
+        POLICY = 'keep_both'
+        THRESHOLD = 0.7
+
+    class Journal:
+        CHECKPOINT_BYTES = 256 * 1024 ** 2
+
+    class Pipeline:
+        QUEUE_SIZE = 64
+
+    class Watch:
+        # seconds a folder must be left alone before it's deployed
+        SETTLE = 10.0
+        POLL_INTERVAL = 30.0
+        BACKEND = 'auto'
+
+        # files still being downloaded (qBittorrent, Firefox, Chrome,
+        # Transmission, aria2...)
+        PARTIAL_EXTENSIONS = {'part', '!qb', 'crdownload', 'partial',
+                              'aria2', 'tmp'}
+
     class Movies:
         YEAR_REGEX_PATTERN = r'^.+__(?P<year>(19|20)\d{2}).+$'
         TITLE_REGEX_PATTERN = r'^(?P<title>[a-zA-Z0-9 \'\-!_&]+).+$'
@@ -52,35 +130,186 @@ class Constants:
 
 
 class Log:
-    """A thread-safe class for logging info to stdout or a specified file"""
+    """A thread-safe class for logging info to stdout or a specified file
+
+    records are queued and written in batches by a background thread,
+    so the threads doing the logging never wait on the console or the disk
+
+    records logged inside group(name) are held back until release(name),
+    so work that runs concurrently can still be logged in one piece
+    """
+
+    LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+    BATCH_SIZE = 256
 
-    def __init__(self):
-        self._console = Console(log_path=False)
-        self._log_file = Console(file=open(Constants.LOG_FILE, 'a'),
-                                 log_path=False)
+    def __init__(self, level: str = 'info'):
+        self.level = Log.LEVELS[level]
 
-        self._print_lock = thr.Lock()
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = thr.Lock()
 
-    def message(self, *text):
-        with self._print_lock:
-            for item in text:
-                lines = item.split('\n')
-                self._console.log(*lines)
-                self._log_file.log(*lines)
+        self._console = None
+        self._log_file = None
+        self._jsonl_path = None
+        self._jsonl_file = None
+
+        self._local = thr.local()
+        self._held = dict()
+        self._held_lock = thr.Lock()
+
+        atexit.register(self.flush)
+
+    def set_level(self, level: str):
+        self.level = Log.LEVELS[level]
+
+    def add_jsonl_sink(self, path: str):
+        """also write every record as a line of JSON to the given file"""
+        self._jsonl_path = path
+
+    def message(self, *text, level: str = 'info'):
+        if Log.LEVELS[level] < self.level:
+            return
+
+        lines = [line for item in text for line in str(item).split('\n')]
+        self._put('message', level, lines)
 
     def header(self, header_text: str):
-        with self._print_lock:
-            self._console.rule(header_text)
-            self._log_file.rule(header_text)
+        self._put('header', 'info', [header_text])
 
     def divider(self):
-        with self._print_lock:
-            self._console.rule()
-            self._log_file.rule()
+        self._put('divider', 'info', [])
+
+    @contextlib.contextmanager
+    def group(self, name: Optional[str]):
+        """holds back what the calling thread logs until release(name)"""
+        previous = getattr(self._local, 'group', None)
+        self._local.group = name
+        try:
+            yield
+        finally:
+            self._local.group = previous
+
+    def release(self, name: str):
+        """writes everything held back for a group, in order"""
+        with self._held_lock:
+            records = self._held.pop(name, [])
+
+        for record in records:
+            self._enqueue(record)
+
+    def flush(self, timeout: float = 10.0):
+        """blocks until every record queued so far has been written"""
+        for name in list(self._held):
+            self.release(name)
+
+        if self._thread is None:
+            return
+
+        written = thr.Event()
+        self._queue.put(written)
+        written.wait(timeout)
+
+    def _put(self, kind: str, level: str, lines: list):
+        record = (time.time(), kind, level, lines)
+
+        group = getattr(self._local, 'group', None)
+        if group is not None:
+            with self._held_lock:
+                self._held.setdefault(group, []).append(record)
+            return
+
+        self._enqueue(record)
+
+    def _enqueue(self, record: tuple):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = thr.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+
+            while len(batch) < Log.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [r for r in batch if not isinstance(r, thr.Event)]
+
+            try:
+                self._write(records)
+            except Exception:
+                # logging must never take down a transfer
+                pass
+
+            for record in batch:
+                if isinstance(record, thr.Event):
+                    record.set()
+
+    def _write(self, records: list):
+        if len(records) == 0:
+            return
+
+        self._open_sinks()
+
+        for timestamp, kind, level, lines in records:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S',
+                                  time.localtime(timestamp))
+
+            if kind == 'message':
+                plain = [f'[{stamp}] {line}' for line in lines]
+            elif kind == 'header':
+                plain = [f'[{stamp}] ---- {lines[0]} ----']
+            else:
+                plain = [f'[{stamp}] ' + '-' * 40]
+
+            self._log_file.write('\n'.join(plain) + '\n')
+
+            if self._console is not None:
+                if kind == 'message':
+                    self._console.log(*lines)
+                elif kind == 'header':
+                    self._console.rule(lines[0])
+                else:
+                    self._console.rule()
+            else:
+                sys.stdout.write('\n'.join(plain) + '\n')
+
+            if self._jsonl_file is not None:
+                record = {'time': timestamp, 'level': level, 'kind': kind,
+                          'text': '\n'.join(lines)}
+                self._jsonl_file.write(json.dumps(record) + '\n')
+
+        self._log_file.flush()
+        sys.stdout.flush()
+
+        if self._jsonl_file is not None:
+            self._jsonl_file.flush()
+
+    def _open_sinks(self):
+        if self._log_file is None:
+            self._log_file = open(Constants.LOG_FILE, 'a')
+
+            # rich formatting is only worth its cost on a terminal, and
+            # only imported then, since it's slow to import
+            if sys.stdout.isatty():
+                from rich.console import Console
+                self._console = Console(log_path=False)
+
+        if self._jsonl_path is not None and self._jsonl_file is None:
+            self._jsonl_file = open(self._jsonl_path, 'a')
 
 
 class Output:
     log = Log()
+    metrics = Metrics()
 
 
 class FileMover:
@@ -101,28 +330,37 @@ class FileMover:
 
 
 class NameCleaner:
+    YEAR = re.compile(r'(19|20)[0-9]{2}')
+    SEASON = re.compile(r'([sS]\d+)')
+    SEASON_FOLDER = re.compile(r'[sS](\d+)')
+    SEASON_FOLDER_LONG = re.compile(r'[sS]eason[ ._-](\d+)')
+    UNDERSCORES = re.compile(r'_{2,}')
+    FILE_EXTENSION = re.compile(r'^(.+)\.([a-z0-9]{2,4})$')
+    EPISODE = re.compile(Constants.Tv.EPISODE_REGEX)
+
+    # replace spaces and common symbols with underscores,
+    # and remove apostrophes and brackets. "꞉" and ":" are not the same
+    SYMBOLS = str.maketrans({**dict.fromkeys('.()_:꞉, ', '_'),
+                             **dict.fromkeys('[]\'', None)})
+
+    @staticmethod
+    def last_year(current_name: str) -> Optional[re.Match]:
+        year = None
+        for year in NameCleaner.YEAR.finditer(current_name):
+            pass
+        return year
 
     @staticmethod
     def movie_name(current_name: str) -> Optional[str]:
-        year = list(re.finditer(r'(19|20)[0-9]{2}', current_name))[-1]
+        year = NameCleaner.last_year(current_name)
+        if year is None:
+            return None
 
         probably_the_name = current_name[:year.start()]
-
-        # replace spaces common symbols with underscores
-        # "꞉" and ":" are not the same
-        probably_the_name = re.sub(r'[.()_:꞉, ]', '_', probably_the_name)
-
-        # remove apostrophes and brackets
-        probably_the_name = re.sub(r'[\[\]\']', '', probably_the_name)
-
-        for token in Constants.Movies.COMMON_TOKENS:
-            if token in probably_the_name:
-                probably_the_name.replace(token, '')
+        probably_the_name = probably_the_name.translate(NameCleaner.SYMBOLS)
 
         clean_name = f'{probably_the_name}_({year.group(0)})'
-
-        while '__' in clean_name:
-            clean_name = clean_name.replace('__', '_')
+        clean_name = NameCleaner.UNDERSCORES.sub('_', clean_name)
 
         if len(clean_name.strip()) > 7:
             return clean_name
@@ -131,33 +369,55 @@ class NameCleaner:
 
     @staticmethod
     def tv_show_name(current_name: str) -> Optional[str]:
-        season = re.search(r'([sS]\d+)', current_name)
+        season = NameCleaner.SEASON.search(current_name)
 
         probably_the_name = (current_name[:season.start()]
                              if season else current_name)
 
-        # replace spaces common symbols with underscores
-        # "꞉" and ":" are not the same
-        probably_the_name = re.sub(r'[.()_:꞉, ]', '_', probably_the_name)
-
-        # remove apostrophes and brackets
-        probably_the_name = re.sub(r'[\[\]\']', '', probably_the_name)
-
-        for token in Constants.Movies.COMMON_TOKENS:
-            if token in probably_the_name:
-                probably_the_name.replace(token, '')
+        probably_the_name = probably_the_name.translate(NameCleaner.SYMBOLS)
 
-        while '__' in probably_the_name:
-            probably_the_name = probably_the_name.replace('__', '_')
+        return NameCleaner.UNDERSCORES.sub('_', probably_the_name)
 
-        if len(probably_the_name.strip()) > 7:
-            return probably_the_name
-
-        return probably_the_name
+    @staticmethod
+    def clean_many(names, kind: str = 'movie') -> list:
+        """cleans a batch of movie or tv show names at once
+
+        gives the same results as movie_name or tv_show_name, but
+        translates and collapses the whole batch in one pass each
+        """
+        names = list(names)
+        if len(names) == 0:
+            return []
+
+        if kind == 'tv':
+            seasons = [NameCleaner.SEASON.search(name) for name in names]
+            prefixes = [name[:season.start()] if season else name
+                        for name, season in zip(names, seasons)]
+        elif kind == 'movie':
+            years = [NameCleaner.last_year(name) for name in names]
+            prefixes = [name[:year.start()] if year else ''
+                        for name, year in zip(names, years)]
+        else:
+            raise ValueError(f'unknown kind of name: {kind}')
+
+        # file names can't contain a null byte, so it can separate them
+        batch = '\0'.join(prefixes).translate(NameCleaner.SYMBOLS)
+
+        if kind == 'movie':
+            batch = '\0'.join(
+                f'{prefix}_({year.group(0)})' if year else ''
+                for prefix, year in zip(batch.split('\0'), years))
+
+        cleaned = NameCleaner.UNDERSCORES.sub('_', batch).split('\0')
+
+        if kind == 'tv':
+            return cleaned
+
+        return [name if len(name.strip()) > 7 else None for name in cleaned]
 
     @staticmethod
     def get_season_num_from_episode(episode_file_name: str) -> str:
-        season_num = re.search(r'([sS]\d+)', episode_file_name)
+        season_num = NameCleaner.SEASON.search(episode_file_name)
         season_num = season_num.group(1) if season_num else None
         season_num = season_num.lower() if season_num else None
         return season_num
@@ -0,0 +1,129 @@
+import re
+from typing import Optional
+from collections import Counter
+
+from mediamanager.subcomponents import Constants, NameCleaner
+
+
+class TitleIndex:
+    """A trigram index over the titles of a movie library, to find movies
+    that are probably already there under a slightly different name, like
+    "matrix_(1999)" for "the_matrix_(1999)"
+
+    titles are only compared with titles from the same year, and scored
+    by the dice coefficient of their trigrams. titles whose numbers differ
+    never match, so "saw_ii_(2005)" isn't taken for "saw_(2004)" and
+    "scream_2_(1997)" isn't taken for "scream_(1997)"
+    """
+
+    WORDS = re.compile(r'[a-z0-9]+')
+    ARTICLES = {'the', 'a', 'an'}
+    ROMAN = re.compile(r'x{0,3}(ix|iv|v?i{0,3})')
+    ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10}
+
+    def __init__(self, threshold: float = Constants.Titles.THRESHOLD):
+        self.threshold = threshold
+        self._titles = list()
+        self._postings = dict()
+
+    def __len__(self):
+        return len(self._titles)
+
+    @staticmethod
+    def split(file_name: str) -> Optional[tuple]:
+        """returns the (normalized title, year) of a movie file name,
+        or None if it has no year"""
+        stem = file_name.lower()
+        extension = NameCleaner.FILE_EXTENSION.search(stem)
+        if extension:
+            stem = extension.group(1)
+
+        year = NameCleaner.last_year(stem)
+        if year is None:
+            return None
+
+        words = TitleIndex.WORDS.findall(stem[:year.start()])
+        while len(words) > 1 and words[0] in TitleIndex.ARTICLES:
+            words = words[1:]
+
+        return ' '.join(words), int(year.group(0))
+
+    @staticmethod
+    def numbers(title: str) -> tuple:
+        """returns the numbers in a title, roman numerals included, eg.
+        (2,) for both rocky 2 and rocky ii"""
+        numbers = list()
+        for word in title.split(' '):
+            if word.isdigit():
+                numbers.append(int(word))
+            elif word and TitleIndex.ROMAN.fullmatch(word):
+                values = [TitleIndex.ROMAN_VALUES[c] for c in word]
+                numbers.append(sum(-value if value < following else value
+                                   for value, following
+                                   in zip(values, values[1:] + [0])))
+        return tuple(numbers)
+
+    @staticmethod
+    def trigrams(title: str) -> set:
+        padded = f'  {title} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, path: str, file_name: str) -> bool:
+        split = TitleIndex.split(file_name)
+        if split is None:
+            return False
+
+        title, year = split
+        grams = TitleIndex.trigrams(title)
+        entry = len(self._titles)
+        self._titles.append((path, TitleIndex.numbers(title), len(grams)))
+
+        for gram in grams:
+            self._postings.setdefault((year, gram), []).append(entry)
+
+        return True
+
+    def match(self, file_name: str, exclude: str = None) -> Optional[tuple]:
+        """returns the (path, score) of the most similar title in the
+        library, or None if nothing scores above the threshold"""
+        split = TitleIndex.split(file_name)
+        if split is None:
+            return None
+
+        title, year = split
+        grams = TitleIndex.trigrams(title)
+        numbers = TitleIndex.numbers(title)
+
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get((year, gram), ()))
+
+        best = None
+        for entry, count in shared.items():
+            path, entry_numbers, size = self._titles[entry]
+            # sequels and volumes share most of their trigrams
+            if entry_numbers != numbers:
+                continue
+
+            score = 2 * count / (len(grams) + size)
+            if path != exclude and score >= self.threshold \
+                    and (best is None or score > best[1]):
+                best = (path, score)
+
+        return best
+
+    @staticmethod
+    def from_files(files, threshold: float = Constants.Titles.THRESHOLD,
+                   extensions=None) -> 'TitleIndex':
+        """builds an index from the (directory, file name) pairs of video
+        files in a library"""
+        if extensions is None:
+            extensions = Constants.PREFERRED_VIDEO_EXTENSIONS.union(
+                Constants.OTHER_VIDEO_EXTENSIONS)
+
+        index = TitleIndex(threshold)
+        for directory, file_name in files:
+            extension = file_name.lower().rsplit('.', 1)[-1]
+            if extension in extensions:
+                index.add(f'{directory}/{file_name}', file_name)
+        return index
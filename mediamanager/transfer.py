@@ -0,0 +1,414 @@
+import io
+import os
+import time
+import errno
+import queue
+import shutil as sh
+import threading as thr
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from mediamanager.subcomponents import Output, Constants
+from mediamanager.checksums import StreamDigest
+
+
+class CopyEngine:
+    """A file copier that picks the cheapest copy the platform supports
+
+    reflinks share blocks on copy-on-write filesystems (btrfs, xfs),
+    copy_file_range and sendfile copy inside the kernel, and the buffered
+    copy is used wherever neither is available
+
+    unless checksum is off, files are hashed as they're copied (which
+    needs the buffered copy) and each copy is checked against its hash
+    """
+
+    STRATEGIES = ('auto', 'reflink', 'copy_file_range', 'sendfile',
+                  'buffered')
+    CHECKSUMS = ('off', 'stream', 'full')
+
+    # linux ioctl from <linux/fs.h>
+    FICLONE = 0x40049409
+
+    def __init__(self, strategy: str = 'auto',
+                 buffer_size: int = Constants.Transfer.BUFFER_SIZE,
+                 checksum: str = 'off', checksums=None):
+        if strategy not in CopyEngine.STRATEGIES:
+            raise ValueError(f'unknown copy strategy: {strategy}')
+        if checksum not in CopyEngine.CHECKSUMS:
+            raise ValueError(f'unknown checksum mode: {checksum}')
+
+        self.strategy = strategy
+        self.buffer_size = buffer_size
+        self.checksum = checksum
+        self.checksums = checksums
+
+    def __call__(self, src: str, dst: str) -> str:
+        return self.copy(src, dst)
+
+    def copy(self, src: str, dst: str, offset: int = 0,
+             progress=None) -> str:
+        """copies src to dst, continuing from offset if dst already holds
+        that many bytes of src. progress(fd, offset) is called per chunk"""
+        start = time.monotonic()
+
+        # a resumed copy must keep the bytes already written
+        mode = 'r+b' if offset > 0 else 'wb'
+        digest = None
+
+        with open(src, 'rb') as fsrc, open(dst, mode) as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            if self.checksum != 'off':
+                digest = StreamDigest(size)
+
+            method = self.copy_fd(fsrc.fileno(), fdst.fileno(), size,
+                                  offset, progress, digest)
+
+        if digest is not None:
+            digest.verify(dst, full=self.checksum == 'full')
+            method += ', verified'
+
+            if self.checksums is not None:
+                self.checksums.record(src, dst, digest)
+
+        elapsed = time.monotonic() - start
+        file_name = dst.replace('\\', '/').split('/')[-1]
+        Output.log.message(f'[COPY] {file_name}: '
+                           f'{CopyEngine.format_rate(size, elapsed)} '
+                           f'via {method}')
+
+        return dst
+
+    def copy_fd(self, fin: int, fout: int, size: int, offset: int = 0,
+                progress=None, digest: StreamDigest = None) -> str:
+        """copies size bytes from fin to fout, returning the method used"""
+        if digest is not None:
+            # the data has to pass through userspace to be hashed,
+            # so reflinks and in-kernel copies are out
+            CopyEngine.preallocate(fout, size)
+            self.rehash(fin, offset, digest)
+            self.buffered(fin, fout, offset, size, progress, digest)
+            return 'buffered'
+
+        if (offset == 0 and self.strategy in ('auto', 'reflink')
+                and self.reflink(fin, fout)):
+            return 'reflink'
+
+        CopyEngine.preallocate(fout, size)
+
+        methods = self.methods()
+
+        for method in methods:
+            try:
+                offset = method(fin, fout, offset, size, progress)
+                return method.__name__
+            except OSError:
+                # the kernel refused (eg. cross-filesystem or unsupported)
+                # or stopped short, so continue from the same offset with
+                # the next method
+                if method is methods[-1]:
+                    raise
+
+        return 'buffered'
+
+    def methods(self) -> list:
+        if self.strategy == 'copy_file_range':
+            return [self.copy_file_range, self.buffered]
+
+        if self.strategy == 'sendfile':
+            return [self.sendfile, self.buffered]
+
+        if self.strategy == 'auto':
+            methods = list()
+            if hasattr(os, 'copy_file_range'):
+                methods.append(self.copy_file_range)
+            if hasattr(os, 'sendfile') and os.name == 'posix':
+                methods.append(self.sendfile)
+            methods.append(self.buffered)
+            return methods
+
+        return [self.buffered]
+
+    def reflink(self, fin: int, fout: int) -> bool:
+        if fcntl is None:
+            return False
+
+        try:
+            fcntl.ioctl(fout, CopyEngine.FICLONE, fin)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def preallocate(fout: int, size: int):
+        if size == 0 or not hasattr(os, 'posix_fallocate'):
+            return
+
+        try:
+            os.posix_fallocate(fout, 0, size)
+        except OSError:
+            pass
+
+    @staticmethod
+    def check_copied(offset: int, size: int):
+        # the destination was preallocated, so a copy that stopped short
+        # would leave a file of the right size with a zero-filled tail
+        if offset < size:
+            raise OSError(errno.EIO,
+                          f'copy stopped at {offset} of {size} bytes')
+
+    def copy_file_range(self, fin: int, fout: int, offset: int, size: int,
+                        progress=None):
+        while offset < size:
+            count = min(self.buffer_size, size - offset)
+            copied = os.copy_file_range(fin, fout, count, offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+
+            if progress is not None:
+                progress(fout, offset)
+
+        CopyEngine.check_copied(offset, size)
+        return offset
+
+    def sendfile(self, fin: int, fout: int, offset: int, size: int,
+                 progress=None):
+        os.lseek(fout, offset, os.SEEK_SET)
+        while offset < size:
+            count = min(self.buffer_size, size - offset)
+            sent = os.sendfile(fout, fin, offset, count)
+            if sent == 0:
+                break
+            offset += sent
+
+            if progress is not None:
+                progress(fout, offset)
+
+        CopyEngine.check_copied(offset, size)
+        return offset
+
+    def rehash(self, fin: int, offset: int, digest: StreamDigest):
+        """feeds the part of a resumed copy that was already written"""
+        position = 0
+        while position < offset:
+            data = os.pread(fin, min(self.buffer_size, offset - position),
+                            position)
+            if not data:
+                break
+            digest.update(position, data)
+            position += len(data)
+
+    def buffered(self, fin: int, fout: int, offset: int, size: int,
+                 progress=None, digest: StreamDigest = None):
+        os.lseek(fin, offset, os.SEEK_SET)
+        os.lseek(fout, offset, os.SEEK_SET)
+
+        reader = io.FileIO(fin, closefd=False)
+        view = memoryview(bytearray(self.buffer_size))
+
+        while True:
+            read = reader.readinto(view)
+            if not read:
+                break
+
+            written = 0
+            while written < read:
+                written += os.write(fout, view[written:read])
+
+            if digest is not None:
+                digest.update(offset, view[:read])
+
+            offset += read
+
+            if progress is not None:
+                progress(fout, offset)
+
+        CopyEngine.check_copied(offset, size)
+        return offset
+
+    @staticmethod
+    def format_rate(size: int, elapsed: float) -> str:
+        mb = size / 1024 ** 2
+        rate = mb / elapsed if elapsed > 0 else 0.0
+        return f'{mb:,.1f} MB in {elapsed:.1f}s, {rate:,.1f} MB/s'
+
+    @staticmethod
+    def from_config(section, checksums=None) -> 'CopyEngine':
+        strategy = section.get('copy_strategy',
+                               Constants.Transfer.STRATEGY)
+        buffer_mb = section.getint('copy_buffer_mb',
+                                   Constants.Transfer.BUFFER_SIZE // 1024 ** 2)
+        checksum = section.get('checksum', Constants.Checksums.MODE)
+
+        return CopyEngine(strategy, buffer_mb * 1024 ** 2, checksum,
+                          checksums)
+
+
+def same_device(*paths) -> bool:
+    try:
+        devices = {os.stat(path).st_dev for path in paths}
+    except OSError:
+        return False
+
+    return len(devices) == 1
+
+
+def hardlink(src: str, dst: str) -> str:
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # a leftover from an earlier run, replace it like a copy would
+        os.remove(dst)
+        os.link(src, dst)
+
+    return dst
+
+
+def operation_by_name(name: str, copy: CopyEngine):
+    """returns the function for an operation returned by
+    choose_operation"""
+    operations = {'copy': copy, 'rename': os.rename, 'hardlink': hardlink}
+
+    if name not in operations:
+        raise ValueError(f'unknown file operation: {name}')
+
+    return operations[name]
+
+
+def choose_operation(src_path: str, stg_path: str, tgt_path: str,
+                     copy: CopyEngine, same_device_operation: str):
+    """returns a (name, function) pair for moving files from src to stage
+
+    files are only copied when the source and the stage are on different
+    devices. otherwise they're either hardlinked, leaving the source in
+    place (eg. so it keeps seeding), or renamed
+    """
+    if same_device_operation == 'copy' or not same_device(src_path,
+                                                          stg_path):
+        return 'copy', copy
+
+    if same_device_operation == 'rename':
+        return 'rename', os.rename
+
+    if same_device_operation == 'link':
+        return 'hardlink', hardlink
+
+    raise ValueError(f'unknown file operation: {same_device_operation}')
+
+
+class Promoter:
+    """A worker that moves staged files to the target one at a time,
+    as soon as each of them finishes staging
+
+    use as a context manager; leaving the context waits for every
+    submitted file to be promoted
+    """
+
+    def __init__(self, stg_path: str, tgt_path: str, journal=None,
+                 checksums=None, group: str = None, fs=None):
+        self.stg_path = stg_path
+        self.tgt_path = tgt_path
+        self.journal = journal
+        self.checksums = checksums
+
+        # the metadata cache of the run, kept up to date with the moves
+        self.fs = fs
+
+        # the log group the promotions are logged under
+        self.group = group
+
+        self.results = list()
+        self.failed = list()
+
+        self._queue = queue.Queue()
+        self._thread = thr.Thread(target=self._run, name='promoter',
+                                  daemon=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self) -> 'Promoter':
+        self._thread.start()
+        return self
+
+    def close(self):
+        """waits for every submitted file to be promoted"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, staged_path: str):
+        self._queue.put(staged_path)
+
+    def _run(self):
+        with Output.log.group(self.group), Output.metrics.phase('promote'):
+            self._promote_all()
+
+    def _promote_all(self):
+        while True:
+            staged_path = self._queue.get()
+            if staged_path is None:
+                break
+
+            self.promote_one(staged_path)
+
+    def promote_one(self, staged_path: str):
+        """promotes a staged file, recording it in results or failed.
+        returns its path on the target, or None if it failed"""
+        try:
+            with Output.metrics.busy('promote'):
+                new_path = self.promote(staged_path)
+            Output.metrics.add_file('promote', new_path)
+            self.results.append(new_path)
+
+            if self.fs is not None:
+                self.fs.remove_file(staged_path)
+                self.fs.add_file(new_path)
+
+            if self.journal is not None:
+                self.journal.promoted(staged_path)
+            if self.checksums is not None:
+                self.checksums.promoted(staged_path.replace('\\', '/'),
+                                        new_path)
+
+            return new_path
+
+        except Exception as e:
+            Output.log.message(f'[FAILED] {staged_path}', f'|- {e}',
+                               level='error')
+            self.failed.append(staged_path)
+            return None
+
+    def target_of(self, staged_path: str) -> str:
+        staged_path = staged_path.replace('\\', '/')
+        return staged_path.replace(self.stg_path, self.tgt_path, 1)
+
+    def promote(self, staged_path: str) -> str:
+        staged_path = staged_path.replace('\\', '/')
+        new_path = self.target_of(staged_path)
+        file_name = new_path.split('/')[-1]
+
+        Output.log.message(f'[FINISH] {file_name}',
+                           f'|- stg: {staged_path}',
+                           f'|- tgt: {new_path}')
+
+        try:
+            os.replace(staged_path, new_path)
+        except FileNotFoundError:
+            if not os.path.isfile(staged_path):
+                raise
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(staged_path, new_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # the stage and the target are on different devices
+            sh.move(staged_path, new_path)
+
+        return new_path
@@ -0,0 +1,174 @@
+import os
+import re
+import queue
+import concurrent.futures
+
+from mediamanager.subcomponents import Constants
+
+
+MEDIA_EXTENSIONS = (Constants.PREFERRED_VIDEO_EXTENSIONS
+                    | Constants.OTHER_VIDEO_EXTENSIONS
+                    | Constants.SUBTITLE_EXTENSIONS)
+
+OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def is_media(name: str) -> bool:
+    return name.rsplit('.', 1)[-1].lower() in MEDIA_EXTENSIONS
+
+
+def list_dir(path: str, sized=is_media):
+    """lists a directory with scandir, returning its subdirectory names and
+    a (name, size, mtime, inode) record for each file
+
+    only the files sized(name) picks are stat'ed, since that's a syscall
+    per file. the others have None for their size, mtime and inode. with
+    sized=None every file is stat'ed
+    """
+    dirs = list()
+    files = list()
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                # the entry's cached type saves a stat per subdirectory
+                if entry.is_dir():
+                    # like os.walk, don't follow links to directories
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                    continue
+
+                if sized is not None and not sized(entry.name):
+                    files.append((entry.name, None, None, None))
+                    continue
+
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            files.append((entry.name, stat.st_size, stat.st_mtime_ns,
+                          stat.st_ino))
+
+    return dirs, files
+
+
+def mount_of(path: str):
+    """returns the (mount point, filesystem type) a path is on, from
+    /proc/self/mounts, or None where that isn't available"""
+    try:
+        with open('/proc/self/mounts', encoding='utf-8') as mounts:
+            lines = mounts.read().splitlines()
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    found = None
+
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+
+        # spaces and the like are octal escaped, eg. "\040"
+        point = OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)),
+                                 fields[1])
+        inside = (path == point or point == '/'
+                  or path.startswith(point.rstrip('/') + '/'))
+        if inside and (found is None or len(point) >= len(found[0])):
+            found = (point, fields[2])
+
+    return found
+
+
+def is_remote(path: str) -> bool:
+    """whether a path is on a network share, where listing a directory is
+    a round trip. unknown platforms are assumed to be remote"""
+    path = path.replace('\\', '/')
+    if path.startswith('//'):
+        return True
+
+    if os.name == 'nt':
+        import ctypes
+
+        # DRIVE_REMOTE, from GetDriveTypeW
+        drive = os.path.splitdrive(os.path.abspath(path))[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4
+
+    mount = mount_of(path)
+    if mount is None:
+        return True
+
+    # fuse filesystems are named after their driver, eg. fuse.sshfs
+    fs_type = mount[1].split('.')[-1]
+    return fs_type in Constants.Scan.NETWORK_FILESYSTEMS
+
+
+class ParallelWalker:
+    """Walks a directory tree, listing sibling directories at the same time
+    on a thread pool, since each listing is a round trip on network shares
+
+    yields (root, dirs, files) like os.walk, where files are the records
+    returned by the lister, in the order the listings complete
+
+    by default, local trees are walked on the calling thread, since there
+    the threads cost more than they save
+    """
+
+    def __init__(self, lister=list_dir, workers: int = None):
+        self.lister = lister
+        self.workers = workers
+
+    def walk(self, top: str):
+        top = top.replace('\\', '/').rstrip('/')
+
+        workers = self.workers
+        if workers is None:
+            workers = Constants.Scan.WORKERS if is_remote(top) else 1
+
+        if workers <= 1:
+            yield from self.walk_serial(top)
+            return
+
+        completed = queue.Queue()
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+        def submit(root):
+            future = executor.submit(self.lister, root)
+            future.add_done_callback(lambda f: completed.put((root, f)))
+
+        try:
+            submit(top)
+            pending = 1
+
+            while pending > 0:
+                root, future = completed.get()
+                pending -= 1
+
+                try:
+                    dirs, files = future.result()
+                except OSError:
+                    continue
+
+                for directory in dirs:
+                    submit(f'{root}/{directory}')
+                    pending += 1
+
+                yield root, dirs, files
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def walk_serial(self, top: str):
+        pending = [top]
+
+        while pending:
+            root = pending.pop()
+
+            try:
+                dirs, files = self.lister(root)
+            except OSError:
+                continue
+
+            pending.extend(f'{root}/{directory}'
+                           for directory in reversed(dirs))
+
+            yield root, dirs, files
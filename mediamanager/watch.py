@@ -0,0 +1,344 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading as thr
+
+from mediamanager.subcomponents import Output, Constants
+from mediamanager.walker import ParallelWalker
+
+
+class InotifyBackend:
+    """Reports the files that change beneath a directory, using inotify
+
+    every directory is watched, and directories created (or moved in)
+    later are watched as they appear. if the kernel's event queue
+    overflows, everything is reported as changed
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, root: str):
+        self.root = root
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        # watch descriptor -> directory
+        self._watches = dict()
+        self.add_tree(root)
+
+    @staticmethod
+    def available() -> bool:
+        libc = ctypes.util.find_library('c')
+        if libc is None:
+            return False
+        return hasattr(ctypes.CDLL(libc), 'inotify_init1')
+
+    def add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                          InotifyBackend.MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                Output.log.message('inotify: out of watches, raise '
+                                   'fs.inotify.max_user_watches',
+                                   level='warning')
+            return
+        self._watches[wd] = directory
+
+    def add_tree(self, top: str):
+        for root, _, _ in os.walk(top):
+            self.add_watch(root.replace('\\', '/'))
+
+    def changes(self, timeout: float) -> set:
+        """returns the paths that changed, waiting up to timeout seconds
+        for the first one"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = InotifyBackend.EVENT.unpack_from(data,
+                                                                   offset)
+            offset += InotifyBackend.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & InotifyBackend.IN_Q_OVERFLOW:
+                changed.add(self.root)
+                continue
+
+            if mask & InotifyBackend.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            path = f'{directory}/{name}' if name else directory
+            changed.add(path)
+
+            # a new folder, eg. a season pack, may already have files in it
+            if mask & InotifyBackend.IN_ISDIR \
+                    and mask & (InotifyBackend.IN_CREATE
+                                | InotifyBackend.IN_MOVED_TO):
+                self.add_tree(path)
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingBackend:
+    """Reports the files that change beneath a directory by listing it
+    every poll_interval seconds, for platforms or filesystems (eg. network
+    shares) that inotify doesn't cover"""
+
+    def __init__(self, root: str,
+                 poll_interval: float = Constants.Watch.POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+
+        self._snapshot = self.snapshot()
+        self._next_poll = time.monotonic() + poll_interval
+
+    def snapshot(self) -> dict:
+        files = dict()
+        for root, _, listing in ParallelWalker().walk(self.root):
+            for name, size, mtime, _ in listing:
+                files[f'{root}/{name}'] = (size, mtime)
+        return files
+
+    def changes(self, timeout: float) -> set:
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+
+        time.sleep(max(0.0, wait))
+        self._next_poll = time.monotonic() + self.poll_interval
+
+        snapshot = self.snapshot()
+        changed = {path for path, stat in snapshot.items()
+                   if self._snapshot.get(path) != stat}
+        self._snapshot = snapshot
+
+        return changed
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    """Watches a library's source folder, and hands the top-level folders
+    (a show or a movie) that received new files to a callback once they've
+    settled
+
+    a folder has settled once nothing happened in it for settle seconds,
+    the sizes of its files didn't change between two checks settle
+    seconds apart, and none of them is a partial download. every folder
+    that settles at the same time goes to the callback in one call, so a
+    season pack is deployed in one batch instead of file by file
+
+    on start, everything already in the source is treated as new, so
+    downloads that finished while nothing was watching aren't missed
+    """
+
+    BACKENDS = ('auto', 'inotify', 'poll')
+
+    def __init__(self, root: str, callback,
+                 settle: float = Constants.Watch.SETTLE,
+                 poll_interval: float = Constants.Watch.POLL_INTERVAL,
+                 backend: str = Constants.Watch.BACKEND):
+        if backend not in Watcher.BACKENDS:
+            raise ValueError(f'unknown watch backend: {backend}')
+
+        self.root = root.replace('\\', '/').rstrip('/')
+        self.callback = callback
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.backend_name = backend
+
+        # top-level folder -> [time of the last change, file sizes when
+        # last checked]
+        self.pending = dict()
+
+        # held while the callback runs, shared by the watchers of run_all
+        self.lock = thr.Lock()
+
+    def open_backend(self):
+        if self.backend_name != 'poll' and InotifyBackend.available():
+            try:
+                return InotifyBackend(self.root)
+            except OSError as e:
+                if self.backend_name == 'inotify':
+                    raise
+                Output.log.message(f'inotify unavailable ({e}), polling',
+                                   level='warning')
+        elif self.backend_name == 'inotify':
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        return PollingBackend(self.root, self.poll_interval)
+
+    def folder_of(self, path: str):
+        """returns the top-level folder a changed path belongs to"""
+        path = path.replace('\\', '/')
+        if path == self.root:
+            return None
+
+        relative = path[len(self.root) + 1:]
+        return relative.split('/', 1)[0]
+
+    def touch(self, folder: str, now: float):
+        if folder in self.pending:
+            self.pending[folder][0] = now
+        else:
+            self.pending[folder] = [now, None]
+
+    def sizes(self, folder: str):
+        """returns the size of every file in a folder, or None if it's
+        gone or still has partial downloads in it"""
+        path = f'{self.root}/{folder}'
+        if os.path.isfile(path):
+            return {path: os.path.getsize(path)}
+        if not os.path.isdir(path):
+            return None
+
+        sizes = dict()
+        for root, _, files in os.walk(path):
+            for name in files:
+                extension = name.rsplit('.', 1)[-1].lower()
+                if extension in Constants.Watch.PARTIAL_EXTENSIONS:
+                    return None
+                try:
+                    sizes[f'{root}/{name}'] = os.path.getsize(
+                        f'{root}/{name}')
+                except OSError:
+                    continue
+
+        return sizes
+
+    def settled(self, now: float) -> list:
+        """returns the pending folders that have settled, and restarts
+        the wait of those that are still changing"""
+        ready = list()
+
+        for folder, (last_change, last_sizes) in list(self.pending.items()):
+            if now - last_change < self.settle:
+                continue
+
+            if not os.path.lexists(f'{self.root}/{folder}'):
+                del self.pending[folder]
+                continue
+
+            sizes = self.sizes(folder)
+            if sizes is not None and sizes == last_sizes:
+                del self.pending[folder]
+                ready.append(folder)
+            else:
+                self.pending[folder] = [now, sizes]
+
+        return sorted(ready)
+
+    def run(self, stop=None):
+        """watches until stop (a threading.Event) is set, or forever"""
+        backend = self.open_backend()
+        Output.log.message(f'watching {self.root} '
+                           f'({type(backend).__name__})')
+
+        now = time.monotonic()
+        for folder in os.listdir(self.root):
+            self.touch(folder, now - self.settle)
+
+        try:
+            while stop is None or not stop.is_set():
+                changed = backend.changes(self.settle)
+
+                now = time.monotonic()
+                for path in changed:
+                    if path == self.root:
+                        for folder in os.listdir(self.root):
+                            self.touch(folder, now)
+                        continue
+
+                    folder = self.folder_of(path)
+                    if folder is not None:
+                        self.touch(folder, now)
+
+                ready = self.settled(now)
+                if len(ready) > 0:
+                    try:
+                        with self.lock:
+                            self.callback(ready)
+                    except Exception as e:
+                        # one bad batch mustn't stop the watch
+                        Output.log.message(e, level='error')
+        finally:
+            backend.close()
+
+    @staticmethod
+    def run_all(watchers: list):
+        """runs watchers until interrupted, each on its own thread
+
+        only one of them deploys at a time, so libraries on the same
+        devices don't go over the transfer limits of each device. when
+        interrupted, a deployment that's running is finished first
+        """
+        stop = thr.Event()
+        lock = thr.Lock()
+
+        threads = list()
+        for watcher in watchers:
+            watcher.lock = lock
+            threads.append(thr.Thread(target=watcher.run, args=(stop,),
+                                      daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            Output.log.message('stopped watching')
+
+    @staticmethod
+    def from_config(section, callback) -> 'Watcher':
+        return Watcher(section['src_path'], callback,
+                       section.getfloat('watch_settle',
+                                        Constants.Watch.SETTLE),
+                       section.getfloat('watch_poll_interval',
+                                        Constants.Watch.POLL_INTERVAL),
+                       section.get('watch_backend', Constants.Watch.BACKEND))
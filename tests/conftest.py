@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """runs each test in its own directory, so the log and any database
+    opened with a relative path don't end up in the repository"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from mediamanager.journal import TransferJournal, TransferCancelled
+from mediamanager.transfer import CopyEngine
+
+CHUNK = 16 * 1024
+SIZE = 20 * CHUNK + 321
+
+
+@pytest.fixture
+def paths(workdir):
+    src = workdir / 'source.mkv'
+    src.write_bytes(os.urandom(SIZE))
+    return str(src), str(workdir / 'staged.mkv'), str(workdir / 'journal')
+
+
+def interrupt_at(journal, offset: int, error=None):
+    """makes the journal stop the copy at its first checkpoint past
+    offset, cancelled like with Ctrl-C, or by raising error"""
+    checkpoint = journal.checkpoint
+
+    def interrupted(dst, fd, position, cancelled=None):
+        if position >= offset:
+            if error is not None:
+                raise error
+            journal.cancel()
+        checkpoint(dst, fd, position, cancelled)
+
+    journal.checkpoint = interrupted
+
+
+def test_resume(paths, monkeypatch):
+    src, dst, db_path = paths
+    engine = CopyEngine('buffered', buffer_size=CHUNK)
+
+    journal = TransferJournal(db_path, checkpoint_bytes=4 * CHUNK)
+    interrupt_at(journal, SIZE // 2)
+
+    with pytest.raises(TransferCancelled):
+        journal.transfer(engine, src, dst)
+
+    _, _, _, status, copied = journal.lookup(dst)
+    assert status == 'copying'
+    assert SIZE // 2 <= copied < SIZE
+    assert os.path.getsize(dst) >= copied
+
+    # the next run opens the journal again and continues from the
+    # checkpoint instead of starting over
+    offsets = list()
+    copy = engine.copy
+
+    def spy(src, dst, offset=0, progress=None):
+        offsets.append(offset)
+        return copy(src, dst, offset=offset, progress=progress)
+
+    monkeypatch.setattr(engine, 'copy', spy)
+
+    journal = TransferJournal(db_path, checkpoint_bytes=4 * CHUNK)
+    journal.transfer(engine, src, dst)
+
+    assert offsets == [copied]
+    assert journal.lookup(dst)[3] == 'staged'
+    with open(src, 'rb') as source, open(dst, 'rb') as staged:
+        assert staged.read() == source.read()
+
+
+def test_rollback(paths):
+    src, dst, db_path = paths
+    engine = CopyEngine('buffered', buffer_size=CHUNK)
+
+    journal = TransferJournal(db_path, checkpoint_bytes=4 * CHUNK)
+    interrupt_at(journal, SIZE // 2, OSError('disk full'))
+
+    with pytest.raises(OSError):
+        journal.transfer(engine, src, dst)
+
+    # only the failed file is removed, and it isn't resumed from
+    assert not os.path.exists(dst)
+    assert journal.lookup(dst)[3] == 'failed'
+    assert journal.resume_offset(src, dst) == 0
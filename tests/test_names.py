@@ -0,0 +1,47 @@
+"""checks NameCleaner against the golden corpus, which was produced by the
+cleaner as it was before names were cleaned in a single pass
+(regenerate it with python benchmarks/bench_names.py --regenerate)"""
+
+import os
+import json
+
+import pytest
+
+from mediamanager.subcomponents import NameCleaner
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'names.golden.jsonl')
+
+
+def golden(kind: str) -> list:
+    with open(GOLDEN_FILE, encoding='utf-8') as records:
+        return [record for record in map(json.loads, records)
+                if record['kind'] == kind]
+
+
+CLEANERS = {'movie': NameCleaner.movie_name,
+            'tv': NameCleaner.tv_show_name}
+
+
+@pytest.mark.parametrize('kind', CLEANERS)
+def test_clean_one(kind):
+    clean = CLEANERS[kind]
+    mismatches = [(record['name'], record['clean'], clean(record['name']))
+                  for record in golden(kind)
+                  if clean(record['name']) != record['clean']]
+
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('kind', CLEANERS)
+def test_clean_many(kind):
+    records = golden(kind)
+    cleaned = NameCleaner.clean_many([record['name'] for record in records],
+                                     kind)
+
+    mismatches = [(record['name'], record['clean'], clean)
+                  for record, clean in zip(records, cleaned)
+                  if clean != record['clean']]
+
+    assert len(cleaned) == len(records)
+    assert mismatches == []
@@ -0,0 +1,115 @@
+"""RenameGraph renames files in place on the target, where a mistake
+loses data, so each case checks what ends up in every file"""
+
+import os
+
+import pytest
+
+from mediamanager.renames import RenameGraph
+
+
+@pytest.fixture
+def library(workdir):
+    # apart from the working directory, which holds the log
+    path = workdir / 'library'
+    path.mkdir()
+    return path
+
+
+def make(directory, contents: dict) -> dict:
+    """creates the files in contents (name -> text), returning their
+    paths by name"""
+    paths = dict()
+    for name, text in contents.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        paths[name] = path
+    return paths
+
+
+def read(directory) -> dict:
+    """returns name -> text of every file beneath directory"""
+    found = dict()
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, encoding='utf-8') as file:
+                found[os.path.relpath(path, directory)] = file.read()
+    return found
+
+
+def rename(library, *renames):
+    graph = RenameGraph([(str(library / old), str(library / new))
+                         for old, new in renames])
+    graph.run()
+    return graph
+
+
+def test_swap(library):
+    make(library, {'a': 'A', 'b': 'B'})
+
+    graph = rename(library, ('a', 'b'), ('b', 'a'))
+
+    assert read(library) == {'a': 'B', 'b': 'A'}
+    assert graph.cycles == 1
+    assert graph.renamed == 2
+    assert graph.conflicts == [] and graph.failed == []
+
+
+def test_chain(library):
+    make(library, {'a': 'A', 'b': 'B'})
+
+    graph = rename(library, ('a', 'b'), ('b', 'c'))
+
+    assert read(library) == {'b': 'A', 'c': 'B'}
+    assert graph.cycles == 0
+    assert graph.renamed == 2
+
+
+def test_collision(library):
+    make(library, {'a': 'A', 'b': 'B'})
+
+    graph = rename(library, ('a', 'n'), ('b', 'n'))
+
+    assert read(library) == {'a': 'A', 'b': 'B'}
+    assert sorted(os.path.basename(old) for old, _, _ in graph.conflicts) \
+        == ['a', 'b']
+    assert graph.renamed == 0
+
+
+def reasons(graph) -> dict:
+    return {os.path.basename(old): reason
+            for old, _, reason in graph.conflicts}
+
+
+def test_blocked_by_a_file(library):
+    make(library, {'a': 'A', 'kept': 'K'})
+
+    graph = rename(library, ('a', 'kept'))
+
+    assert read(library) == {'a': 'A', 'kept': 'K'}
+    assert reasons(graph) == {'a': 'already exists'}
+    assert graph.renamed == 0
+
+
+def test_blocked_by_a_conflict(library):
+    make(library, {'a': 'A', 'b': 'B', 'c': 'C'})
+
+    # a and b collide, so a stays where it is and c can't take its place
+    graph = rename(library, ('a', 'n'), ('b', 'n'), ('c', 'a'))
+
+    assert read(library) == {'a': 'A', 'b': 'B', 'c': 'C'}
+    assert reasons(graph)['c'] == 'blocked by a conflict'
+    assert graph.renamed == 0
+
+
+def test_duplicate_source(library):
+    make(library, {'x': 'X'})
+
+    graph = rename(library, ('x', 'n'), ('x', 'e/q'))
+
+    assert read(library) == {'x': 'X'}
+    assert len(graph.conflicts) == 2
+    assert graph.renames == [] and graph.renamed == 0
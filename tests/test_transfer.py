@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from mediamanager.transfer import CopyEngine
+
+SIZE = 3 * 64 * 1024 + 123
+
+
+@pytest.fixture
+def source(workdir):
+    path = workdir / 'source.mkv'
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.mark.parametrize('call', ['copy_file_range', 'sendfile'])
+def test_short_copy_falls_back(source, workdir, monkeypatch, call):
+    if not hasattr(os, call):
+        pytest.skip(f'no os.{call}')
+
+    real = getattr(os, call)
+    calls = list()
+
+    def stops_after_one_chunk(*args):
+        # like a kernel that copies one chunk, then reports end of file
+        calls.append(args)
+        return real(*args) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(os, call, stops_after_one_chunk)
+
+    engine = CopyEngine(call, buffer_size=64 * 1024)
+
+    destination = workdir / 'copy.mkv'
+    with open(source, 'rb') as fin, open(destination, 'wb') as fout:
+        method = engine.copy_fd(fin.fileno(), fout.fileno(), SIZE)
+
+    assert method == 'buffered'
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_short_buffered_copy_raises(source, workdir):
+    destination = workdir / 'copy.mkv'
+    engine = CopyEngine('buffered', buffer_size=64 * 1024)
+
+    # the source is shorter than the size the copy was planned for
+    with open(source, 'rb') as fin, open(destination, 'wb') as fout:
+        with pytest.raises(OSError):
+            engine.copy_fd(fin.fileno(), fout.fileno(), SIZE + 1)